@@ -0,0 +1,216 @@
+"""
+Precomputes the positions of the bikes in a bikeset at fixed time steps, so that clients animating the visualization
+do not have to interpolate thousands of trips along their geometries themselves.
+
+Frames are stored as a (frames x bikes x 2) float32 array of [latitude, longitude] positions in a `.npy` file, which
+is memory-mapped on read, so that serving a range of frames is just a slice. Timing and bike ids are stored alongside
+it in a `.json` file of the same name.
+
+Run as a script this builds the frames for a station bikeset, or for every trip in a time window.
+"""
+
+import citibike_trips
+import json
+import os
+import numpy as np
+
+
+def trip_times(trips):
+    """
+    Returns arrays of the start and stop times of a set of trips, in epoch seconds. Trips written before the numeric
+    times were added (see `epoch_migration_script.py`) have them computed on the fly.
+    """
+    props = [trip['properties'] for trip in trips]
+    starts = [p['startepoch'] if 'startepoch' in p else citibike_trips.to_epoch(p['starttime']) for p in props]
+    stops = [p['stopepoch'] if 'stopepoch' in p else citibike_trips.to_epoch(p['stoptime']) for p in props]
+    return np.array(starts, dtype=np.int64), np.array(stops, dtype=np.int64)
+
+
+def interpolate_positions(trips, times):
+    """
+    Computes the position of every bike in a set of trips at each of the given times.
+
+    Bikes move along the geometry of their current trip at a constant speed, by cumulative path length. Before its
+    first trip a bike sits at the start of that trip; between and after trips it sits where its last trip ended.
+
+    Parameters
+    ----------
+    trips: list
+        Trips in the format returned by `DataStore.get_station_bikeset`, with geometry attached.
+    times: np.ndarray
+        The times to compute positions at, in epoch seconds (see `citibike_trips.to_epoch`).
+
+    Returns
+    -------
+    A tuple of the sorted array of bike ids and a (len(times) x bikes x 2) float32 array of [latitude, longitude]
+    positions.
+    """
+    paths = TripPaths(trips)
+    return paths.bike_ids, paths.positions(times)
+
+
+class TripPaths:
+    """
+    Class encoding the geometry of a set of trips, flattened and ordered for interpolating bike positions along.
+
+    None of this depends on the times being interpolated at, so it is computed once and reused for every chunk of
+    frames. See `interpolate_positions`.
+    """
+    def __init__(self, trips):
+        self.starts, self.stops = trip_times(trips)
+        self.bike_ids, bikes = np.unique(np.array([trip['properties']['bikeid'] for trip in trips]),
+                                         return_inverse=True)
+        if len(trips) == 0:
+            return
+        # Flatten every trip geometry into one array of points. Trips missing geometry go in a straight line between
+        # stations, and every trip gets at least two points so that it has a segment to interpolate along.
+        paths = []
+        for trip in trips:
+            path = trip['geometry']['coordinates']
+            if len(path) == 0:
+                path = [[trip['properties']['start station latitude'], trip['properties']['start station longitude']],
+                        [trip['properties']['end station latitude'], trip['properties']['end station longitude']]]
+            elif len(path) == 1:
+                path = [path[0], path[0]]
+            paths.append(np.asarray(path, dtype=np.float64))
+        self.lengths = np.array([len(path) for path in paths])
+        self.first_points = np.concatenate([[0], np.cumsum(self.lengths)[:-1]])
+        self.points = np.concatenate(paths)
+        # Segment lengths, with longitude scaled to roughly match latitude at New York's latitude.
+        scale = np.array([1, np.cos(np.radians(self.points[:, 0].mean()))])
+        segments = np.linalg.norm(np.diff(self.points, axis=0) * scale, axis=1)
+        # The segment between the last point of one trip and the first point of the next is not travelled.
+        segments[self.first_points[1:] - 1] = 0
+        self.distances = np.concatenate([[0], np.cumsum(segments)])
+        self.trip_lengths = self.distances[self.first_points + self.lengths - 1] - self.distances[self.first_points]
+        # Order the trips by bike and then by start time, keyed so that a single search finds a bike's current trip.
+        self.order = np.lexsort((self.starts, bikes))
+        self.origin = self.starts.min()
+        self.span = self.starts.max() - self.origin + 1
+        self.keys = bikes[self.order] * self.span + (self.starts[self.order] - self.origin)
+        self.first_trips = np.searchsorted(bikes[self.order], np.arange(len(self.bike_ids)))
+
+    def positions(self, times):
+        """
+        Returns the (len(times) x bikes x 2) float32 array of the positions of the bikes at the given times.
+        """
+        times = np.asarray(times, dtype=np.int64)
+        if len(self.bike_ids) == 0:
+            return np.zeros((len(times), 0, 2), dtype=np.float32)
+        # For every (time, bike) find the bike's current trip: the last one which started at or before that time, or
+        # its first one if it has not set out yet. Times outside of the trip start times are clipped into them, which
+        # finds the same trips.
+        offsets = np.clip(times, self.origin, self.origin + self.span - 1) - self.origin
+        queries = np.arange(len(self.bike_ids))[np.newaxis, :] * self.span + offsets[:, np.newaxis]
+        current = np.searchsorted(self.keys, queries, side='right') - 1
+        current = np.maximum(current, self.first_trips[np.newaxis, :])
+        current = self.order[current]
+        # Move each bike along its current trip in proportion to the time elapsed.
+        durations = np.maximum(self.stops - self.starts, 1)[current]
+        fractions = np.clip((times[:, np.newaxis] - self.starts[current]) / durations, 0, 1)
+        targets = self.distances[self.first_points[current]] + fractions * self.trip_lengths[current]
+        segment = np.searchsorted(self.distances, targets, side='right') - 1
+        segment = np.clip(segment, self.first_points[current], self.first_points[current] + self.lengths[current] - 2)
+        segment_lengths = self.distances[segment + 1] - self.distances[segment]
+        weights = np.divide(targets - self.distances[segment], segment_lengths,
+                            out=np.zeros_like(targets), where=segment_lengths > 0)
+        positions = self.points[segment] + weights[..., np.newaxis] * (self.points[segment + 1] - self.points[segment])
+        return positions.astype(np.float32)
+
+
+class AnimationFrames:
+    """
+    Class encoding a memory-mapped set of precomputed animation frames.
+    """
+    def __init__(self, filename):
+        """
+        Opens previously built animation frames. The filename is that of the `.npy` file.
+        """
+        self.frames = np.load(filename, mmap_mode='r')
+        with open(os.path.splitext(filename)[0] + '.json') as f:
+            metadata = json.load(f)
+        self.start = metadata['start']
+        self.step = metadata['step']
+        self.bike_ids = metadata['bike ids']
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, item):
+        return self.frames[item]
+
+    def frame_index(self, time):
+        """
+        Returns the index of the frame at or just before the given time, in epoch seconds.
+        """
+        return int(np.clip((time - self.start) // self.step, 0, len(self) - 1))
+
+    def get_frames(self, start, stop):
+        """
+        Returns the frames between the start and stop times (inclusive, in epoch seconds) as a read-only
+        (frames x bikes x 2) array, without reading any of the others from disk.
+        """
+        return self.frames[self.frame_index(start):self.frame_index(stop) + 1]
+
+    @classmethod
+    def build(cls, trips, filename, start=None, stop=None, step=60, chunksize=256):
+        """
+        Computes the animation frames for a set of trips and writes them to disk, returning the result.
+
+        Parameters
+        ----------
+        trips: list
+            Trips in the format returned by `DataStore.get_station_bikeset`, with geometry attached.
+        filename: str
+            The `.npy` file to write the frames to. Metadata is written next to it, in a `.json` file.
+        start: int
+            The time of the first frame, in epoch seconds. Defaults to the start of the earliest trip.
+        stop: int
+            The time of the last frame, in epoch seconds. Defaults to the end of the latest trip.
+        step: int
+            The number of seconds between frames.
+        chunksize: int
+            The number of frames computed at a time. This bounds memory use for long or busy animations.
+        """
+        paths = TripPaths(trips)
+        if len(trips) == 0 and (start is None or stop is None):
+            # With no trips and no explicit time span there is nothing to animate.
+            start = stop = 0
+            times = np.array([], dtype=np.int64)
+        else:
+            start = int(paths.starts.min()) if start is None else start
+            stop = int(paths.stops.max()) if stop is None else stop
+            times = np.arange(start, stop + 1, step, dtype=np.int64)
+        frames = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32,
+                                           shape=(len(times), len(paths.bike_ids), 2))
+        for i in range(0, len(times), chunksize):
+            frames[i:i + chunksize] = paths.positions(times[i:i + chunksize])
+        frames.flush()
+        del frames
+        with open(os.path.splitext(filename)[0] + '.json', 'w') as f:
+            json.dump({'start': start, 'step': step, 'bike ids': paths.bike_ids.tolist()}, f)
+        return cls(filename)
+
+
+def main():
+    uri = input("Enter a valid MongoDB connection URI: ")
+    db = citibike_trips.DataStore(uri=uri)
+    station_id = input("Enter a station id (or leave blank to animate every trip in a time window): ")
+    f = input("Where do you want to store this (.npy): ")
+    step = int(input("How many seconds apart should frames be: "))
+    try:
+        if station_id:
+            mode = input("Enter a tripset (e.g. 'outbound bike trip indices'): ")
+            trips = db.get_station_bikeset(station_id, mode)
+        else:
+            start = input("Enter the window start time (e.g. 6/22/2016 00:00:00): ")
+            stop = input("Enter the window stop time (e.g. 6/23/2016 00:00:00): ")
+            trips = db.get_trips_in_window(start, stop)
+        frames = AnimationFrames.build(trips, f, step=step)
+        print("Wrote {0} frames of {1} bikes.".format(len(frames), len(frames.bike_ids)))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
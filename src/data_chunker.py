@@ -10,7 +10,6 @@ import citibike_trips
 import googlemaps
 import pandas as pd
 import random
-from tqdm import tqdm
 
 
 def main():
@@ -32,20 +31,12 @@ def main():
             print("There are {0} trips already in the database.".format(len(keys_already_stored)))
             print("There are {0} trips left to process.".format(len(fresh_trip_indices)))
             print("Running job...")
-            ids_to_insert = random.sample(fresh_trip_indices, min(int(n), len(fresh_trip_indices)))
-            trips_to_process = all_data.ix[ids_to_insert]
-            for trip_id, trip in tqdm(trips_to_process.iterrows()):
-                trip.name = trip_id
-                try:
-                    if trip['usertype'] == 'Rebalancing':
-                        citibike_trips.RebalancingTrip(trip, client).to_mongodb(db)
-                    else:
-                        citibike_trips.BikeTrip(trip, client).to_mongodb(db)
-                # Sometimes a trip with impossible coordinates is passed---e.g. it appears that a few CitiBikes
-                # take a ferry ride between Governer's Island and mainland Manhattan. For these cases we bake in an
-                # exception clause.
-                except:
-                    pass
+            ids_to_insert = random.sample(sorted(fresh_trip_indices), min(int(n), len(fresh_trip_indices)))
+            trips_to_process = citibike_trips.TripBatch(all_data.loc[ids_to_insert], client)
+            # Trips which cannot be geocoded (e.g. it appears that a few CitiBikes take a ferry ride between Governer's
+            # Island and mainland Manhattan) are skipped by the data store.
+            inserted = db.insert_trips(trips_to_process)
+            print("Inserted {0} trips.".format(len(inserted)))
     finally:
         db.close()
         print("Done.")
@@ -0,0 +1,560 @@
+"""
+The CitiBike data storage layer. See `citibike_trips`.
+
+This module is on the read path of the web front-end, so it only imports pymongo up front. The trip model (which
+needs pandas) and the spatial indices (which need numpy) are imported on first use.
+"""
+
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+import pymongo
+import random
+import importlib
+import numbers
+import warnings
+import calendar
+from datetime import datetime
+
+
+def _import_sibling(name):
+    """
+    Imports one of the other modules of this library on first use. This works whether the library is imported as a
+    package (as the notebooks do) or module by module (as the scripts do).
+    """
+    return importlib.import_module(('.' if __package__ else '') + name, __package__ or None)
+
+
+class DataStore:
+    """
+    Class encoding the Citibike data storage layer.
+    """
+    # The tripsets stored per station in the "station-indices" store. See notebook 11.
+    tripset_names = ['inbound bike trip indices', 'outbound bike trip indices',
+                     'incoming trip indices', 'outgoing trip indices']
+
+    # INITIALIZATION
+    def __init__(self, uri, max_trip_duration=None):
+        """
+        Initializes a connection to a MongoDB database.
+
+        Time window queries only look as far back as the longest trip in the data store, which is recorded as trips
+        are inserted (see `record_max_trip_duration`) and read back by every query, so that a long-running web process
+        sees trips inserted after it started. Pass max_trip_duration, in seconds, to use that fixed value instead.
+        """
+        try:
+            client = MongoClient(uri)
+            client.server_info()
+        except ServerSelectionTimeoutError as err:
+            raise err
+        self.client = client
+        # If an index on (start station id, end station id) pairs have not already been created, create it.
+        # This operation is idempotent, if the index already exists it does nothing.
+        self.client['citibike']['trip-geometries'].create_index([('start station id', pymongo.ASCENDING),
+                                                                 ('end station id', pymongo.ASCENDING)])
+        # Likewise for the numeric trip times, which time window queries run against.
+        self.client['citibike']['citibike-trips'].create_index([('properties.startepoch', pymongo.ASCENDING),
+                                                                ('properties.stopepoch', pymongo.ASCENDING)])
+        # And for the trip stations, which viewport queries run against. MongoDB only uses indices for an $or if every
+        # clause can use one, and some clauses only match on the end station, so that gets an index of its own.
+        self.client['citibike']['citibike-trips'].create_index([('properties.start station id', pymongo.ASCENDING),
+                                                                ('properties.end station id', pymongo.ASCENDING)])
+        self.client['citibike']['citibike-trips'].create_index([('properties.end station id', pymongo.ASCENDING)])
+        # Bike trips are matched by their station pair key (see `station_pair`), whichever way around they go.
+        self.client['citibike']['citibike-trips'].create_index([('properties.station pair', pymongo.ASCENDING)])
+        # And for the trip ids, which trips are looked up by.
+        self.client['citibike']['citibike-trips'].create_index([('properties.tripid', pymongo.ASCENDING)])
+        # The id list keeps one document per trip id. It shares its store with a few documents which are not ids, hence
+        # the sparse index.
+        self.client['citibike']['citibike-trip-ids'].create_index([('tripid', pymongo.ASCENDING)], unique=True,
+                                                                  sparse=True)
+        # Spatial indices are built on first use. See `build_spatial_index`.
+        self.station_index = None
+        self.geometry_index = None
+        self.max_trip_duration = max_trip_duration
+
+    # INSERTION
+    def update_trip_id_list(self, new_ids):
+        """
+        Updates the list of trip ids stored in the "citibike-trip-ids" store to include the additional ones.
+
+        The list is kept as one document per id. It used to be a single document holding every id, but MongoDB caps
+        documents at 16 MB, which is only about a million ids, or less than a month of trips; and every update rewrote
+        the whole thing. Data stores which still have that document can be migrated with `integrity_verifier.py`.
+        """
+        requests = [pymongo.UpdateOne({'tripid': int(tripid)}, {'$setOnInsert': {'tripid': int(tripid)}}, upsert=True)
+                    for tripid in new_ids]
+        if requests:
+            self.client['citibike']['citibike-trip-ids'].bulk_write(requests, ordered=False)
+
+    def insert_trip(self, trip):
+        """
+        Inserts a single trip (either a BikeTrip or a RebalancingTrip) into the database.
+        """
+        path = self.client['citibike']['trip-geometries'].find_one({
+            'start station id': trip['start station id'],
+            'end station id': trip['end station id']
+        })
+        reverse_path = self.client['citibike']['trip-geometries'].find_one({
+            'start station id': trip['end station id'],
+            'end station id': trip['start station id']
+        })
+        if path:
+            # The geometry has already been stored in the database. Do nothing.
+            pass
+        elif reverse_path:
+            # The geometry has already been stored in the database, just backwards. Do nothing.
+            pass
+        else:
+            # The geometry has not already been stored in the database, so insert it (if it's a BikeTrip!).
+            if isinstance(trip, _import_sibling('trip_model').BikeTrip):
+                self.client['citibike']['trip-geometries'].insert_one({
+                    'start station id': trip['start station id'],
+                    'end station id': trip['end station id'],
+                    'coordinates': trip['coordinates']
+                })
+            else:  # I don't cache rebalancing trip geometry; that's stored inline.
+                pass
+        document = trip.data
+        document['properties']['station pair'] = self.station_pair(trip['start station id'], trip['end station id'])
+        self.client['citibike']['citibike-trips'].insert_one(document)
+        self.update_trip_id_list([trip.id])
+        self.record_max_trip_duration([document])
+
+    def insert_trips(self, batch):
+        """
+        Inserts a whole TripBatch into the database.
+
+        This does the same work as calling `insert_trip` on every trip in the batch, but looks up the geometries
+        already in the database with a single request, geocodes every new (start station, end station) pair only once,
+        and writes the new geometries, the trips, and the id list in one request apiece.
+
+        Trips which could not be geocoded are skipped. Returns the list of ids of the trips which were inserted.
+        """
+        pairs = [tuple(pair) for pair in batch.station_pairs().tolist()]
+        regular = [i for i in range(len(batch)) if not batch.rebalancing[i]]
+        rebalancing = [i for i in range(len(batch)) if batch.rebalancing[i]]
+        stored = self.get_stored_geometry_pairs({pairs[i] for i in regular})
+        # Pick out one trip to geocode for each geometry which is not already stored.
+        to_geocode = dict()
+        for i in regular:
+            if pairs[i] not in stored and pairs[i] not in to_geocode and pairs[i][::-1] not in to_geocode:
+                to_geocode[pairs[i]] = i
+        failed = set(batch.geocode(list(to_geocode.values()) + rebalancing))
+        failed_pairs = {pairs[i] for i in failed if not batch.rebalancing[i]}
+        failed_pairs |= {pair[::-1] for pair in failed_pairs}
+        new_geometries = [{'start station id': sid, 'end station id': eid, 'coordinates': batch.coordinates(i)}
+                          for (sid, eid), i in to_geocode.items() if i not in failed]
+        if new_geometries:
+            self.client['citibike']['trip-geometries'].insert_many(new_geometries)
+        # I don't cache rebalancing trip geometry; that's stored inline.
+        positions = [i for i in rebalancing if i not in failed] + [i for i in regular if pairs[i] not in failed_pairs]
+        if not positions:
+            return []
+        documents = batch.to_documents(sorted(positions))
+        for document in documents:
+            document['properties']['station pair'] = self.station_pair(document['properties']['start station id'],
+                                                                       document['properties']['end station id'])
+        self.client['citibike']['citibike-trips'].insert_many(documents)
+        ids = [document['properties']['tripid'] for document in documents]
+        self.update_trip_id_list(ids)
+        self.record_max_trip_duration(documents)
+        return ids
+
+    @staticmethod
+    def station_pair(start_station_id, end_station_id):
+        """
+        Returns the station pair key stored on every trip, e.g. "72-479". The key does not depend on the direction of
+        the trip, as trip geometries do not: a trip from 479 to 72 has the same key, and the same geometry.
+
+        Trips written before the key existed are given it by `epoch_migration_script.py`.
+        """
+        return "{0}-{1}".format(*sorted([int(start_station_id), int(end_station_id)]))
+
+    def record_max_trip_duration(self, trips):
+        """
+        Raises the longest trip duration recorded in the "citibike-trip-ids" store, if any of the given trips is longer.
+        Time window queries rely on this to bound how far back they have to look.
+        """
+        duration = max((trip['properties']['stopepoch'] - trip['properties']['startepoch'] for trip in trips),
+                       default=None)
+        if duration is None:
+            return
+        self.client['citibike']['citibike-trip-ids'].update_one({'name': 'max-trip-duration'},
+                                                                {'$max': {'seconds': int(duration)}}, upsert=True)
+
+    def get_max_trip_duration(self):
+        """
+        Returns the longest trip duration in the data store, in seconds, or None if none has been recorded. A
+        max_trip_duration passed to the constructor is returned instead, if there was one.
+        """
+        if self.max_trip_duration is not None:
+            return self.max_trip_duration
+        stored = self.client['citibike']['citibike-trip-ids'].find_one({'name': 'max-trip-duration'})
+        return stored['seconds'] if stored else None
+
+    def insert_geometry(self, start_station_id, end_station_id, coordinates):
+        """
+        Inserts a single (start station, end station) trip geometry into the database.
+        """
+        self.client['citibike']['trip-geometries'].insert_one({
+            'start station id': start_station_id,
+            'end station id': end_station_id,
+            'coordinates': coordinates
+        })
+
+    def update_station_indices(self, indices):
+        """
+        Merges new trips into the station trip indices stored in the "station-indices" store.
+
+        Expects a dict of the form {station id: {tripset name: [trip ids]}}. Only the stations present in the dict are
+        touched; stations which do not have an index yet get one.
+        """
+        requests = []
+        for station_id, tripsets in indices.items():
+            update = {'tripsets.{0}'.format(name): {'$each': tripsets.get(name, [])} for name in self.tripset_names}
+            requests.append(pymongo.UpdateOne({'station id': str(station_id)}, {'$addToSet': update}, upsert=True))
+        if requests:
+            self.client['citibike']['station-indices'].bulk_write(requests, ordered=False)
+
+    # GETTERS
+    def get_stored_geometry_pairs(self, pairs):
+        """
+        Given an iterable of (start station id, end station id) pairs, returns the set of those pairs whose geometry is
+        already stored in the database, in either orientation. Both orientations of every stored pair are included.
+        """
+        pairs = set(pairs)
+        stored = set()
+        if pairs:
+            query = {'$or': [{'start station id': sid, 'end station id': eid} for sid, eid in pairs] +
+                            [{'start station id': eid, 'end station id': sid} for sid, eid in pairs]}
+            for geom in self.client['citibike']['trip-geometries'].find(query, {'start station id': 1,
+                                                                               'end station id': 1}):
+                stored.add((geom['start station id'], geom['end station id']))
+                stored.add((geom['end station id'], geom['start station id']))
+        return stored
+
+    def get_stored_trip_ids(self, tripset):
+        """
+        Returns the subset of the given trip ids which are already stored in the database.
+        """
+        trips = self.client['citibike']['citibike-trips'].find({'properties.tripid': {'$in': tripset}},
+                                                               {'properties.tripid': 1})
+        return [trip['properties']['tripid'] for trip in trips]
+
+    def get_trips_by_ids(self, tripset):
+        """
+        Returns a list of trips selected by ID.
+
+        Trips which are missing from the database are left out.
+        """
+        # First find all trips which are in our id list.
+        trips = list(self.client['citibike']['citibike-trips'].find({'properties.tripid': {"$in": tripset}}))
+        return self.attach_geometries(trips)
+        # Speedup relative to using `get_trip_by_id`: get_trip_by_id() returns ~25 trips/second, with a ~2 minute (!)
+        # wait time for the 3376 trips returned by Penn Station Valet (timing according to the Firefox web console,
+        # so it includes packaging and downloading the request). Using this method instead I found:
+        # >>> %timeit list(db.get_trips_by_ids(np.random.choice(data.index.values, size=1000).tolist()))
+        #     1 loop, best of 3: 1.95 s per loop
+        # >>> %timeit list(db.get_trips_by_ids(np.random.choice(data.index.values, size=10000).tolist()))
+        #     1 loop, best of 3: 24.4 s per loop
+        #
+        # This translates to ~8 seconds for the example of Penn Station Valet.
+
+    def get_trips_in_window(self, start, stop, station_id=None, mode=None, tripset=None, skip=0, limit=0):
+        """
+        Returns a list of the trips which are active at some point between the start and stop times, ordered by start
+        time. Times may be given as datetimes, as strings, or as epoch seconds (see `trip_model.to_epoch`).
+
+        The trips may optionally be restricted to a tripset, either given directly or as a station id and tripset
+        name (see `get_station_bikeset`). Use skip and limit to page through a busy window.
+        """
+        query = self._trip_query(start=start, stop=stop, station_id=station_id, mode=mode, tripset=tripset)
+        cursor = self.client['citibike']['citibike-trips'].find(query).sort('properties.startepoch', pymongo.ASCENDING)
+        trips = list(cursor.skip(skip).limit(limit))
+        return self.attach_geometries(trips)
+
+    def get_trips_in_bbox(self, bbox, start=None, stop=None, skip=0, limit=0):
+        """
+        Returns a list of the trips whose path passes through the given bounding box, of the form (min latitude, min
+        longitude, max latitude, max longitude). Use skip and limit to page through the result.
+
+        Bike trips are matched by the bounding box of their geometry, so a few trips near the edges of the box may be
+        returned which do not actually cross it. Rebalancing trip geometry is stored inline and is not indexed, so
+        rebalancing trips are matched if they start or end at a station inside of the box.
+
+        Zoomed-out boxes can intersect tens of thousands of geometries, so bike trips are matched by their station pair
+        key (see `station_pair`) with a single indexed $in, rather than with a clause per geometry.
+
+        If start and stop times are given, only the trips active during that time window are returned (see
+        `get_trips_in_window`).
+        """
+        if self.geometry_index is None:
+            self.build_spatial_index()
+        pairs = self.geometry_index.intersecting(bbox)
+        stations = self.station_index.within(bbox)
+        keys = sorted({self.station_pair(sid, eid) for sid, eid in pairs})
+        # Every clause matches on indexed station fields, so that MongoDB can answer the $or from the indices.
+        query = {'$or': [{'properties.usertype': 'Rebalancing', 'properties.start station id': {'$in': stations}},
+                         {'properties.usertype': 'Rebalancing', 'properties.end station id': {'$in': stations}},
+                         {'properties.usertype': {'$ne': 'Rebalancing'}, 'properties.station pair': {'$in': keys}}]}
+        if start is not None and stop is not None:
+            query.update(self._window_query(start, stop))
+        cursor = self.client['citibike']['citibike-trips'].find(query).sort('properties.startepoch', pymongo.ASCENDING)
+        trips = list(cursor.skip(skip).limit(limit))
+        return self.attach_geometries(trips)
+
+    def get_nearest_stations(self, latitude, longitude, k=1):
+        """
+        Returns the ids of the k stations nearest to the given point, nearest first.
+        """
+        if self.station_index is None:
+            self.build_spatial_index()
+        return self.station_index.nearest(latitude, longitude, k=k)
+
+    def get_stations_in_bbox(self, bbox):
+        """
+        Returns the ids of the stations inside of the given bounding box, of the form (min latitude, min longitude,
+        max latitude, max longitude).
+        """
+        if self.station_index is None:
+            self.build_spatial_index()
+        return self.station_index.within(bbox)
+
+    def attach_geometries(self, trips):
+        """
+        Fills in the geometries of a list of trips fetched from the "citibike-trips" store, in place, and returns it
+        (with the MongoDB `_id` fields removed). The order of the trips is kept.
+        """
+        # Create a geoms list, which will store a list of requested geometries. The reason for this variable is that
+        # requesting these geometries one at a time, as would be necessary otherwise, is inefficient; it is better if
+        # we can request them all at once. Some additional folds to keep in mind here:
+        # (1) Rebalancing trips, which occur on vans, not on bicycles, store their geometry inline with their
+        #     definition. (in retrospect this was probably a mistake to do, but whatever)
+        # (2) If the database does not have the geometry for the start-station-->end-station orientation of the trip,
+        #     there is an approximately-equal chance that it instead has the end-station-->start-station orientation
+        #     stored. Thus we need to associate data twice, once for each direction.
+        # (3) This code should work with partial data, e.g. while a data storage layer is being built.
+        # Split into rebalancing trips which don't need addressing and regular ones which do.
+        rebalancing_trips = [trip for trip in trips if trip['properties']['usertype'] == 'Rebalancing']
+        regular_trips = [trip for trip in trips if trip['properties']['usertype'] != 'Rebalancing']
+        # Create a list of valid geometries that we want.
+        # Many trips share a station pair, so each pair is only asked for once.
+        requested_geometries = list({(trip['properties']['start station id'], trip['properties']['end station id'])
+                                       for trip in regular_trips})
+        requested_geometries_backwards = [geom[::-1] for geom in requested_geometries]
+        # At this point we have a list of station geometries that we want of the form [[station_A, station_B], [..]].
+        # Next we build the conditional logical string that we throw at MongoDB to generate our geometry list. This
+        # needs to be a pairwise request which asks that both of the properties that we want are equal to what we
+        # want them to be. Here's an example pymongo snippet for something like this that you can plug into IPython
+        # and run:
+        # >>> import json
+        # >>> from pymongo import MongoClient
+        # >>> mongo_uri = json.load(open("../credentials/mlab_instance_api_key.json"))['uri']
+        # >>> client = MongoClient(mongo_uri)
+        # >>> len(list(client['citibike']['trip-geometries'].find({'$or':
+        # >>>       [{'start station id': 3078, 'end station id': 3100},
+        # >>>        {'start station id': 410, 'end station id': 3148}]})))
+        pymongo_request_string = {'$or': [{'start station id': sid, 'end station id': eid} for sid, eid in
+                                          requested_geometries + requested_geometries_backwards]}
+        # MongoDB rejects an empty $or, so skip the request when there are no regular trips to match.
+        database_geometries = list(self.client['citibike']['trip-geometries'].find(pymongo_request_string)) \
+            if regular_trips else []
+        database_geometry_coordinates = {(geom['start station id'], geom['end station id']): geom['coordinates']
+                                         for geom in database_geometries}
+        # Now we plug the geometries we got back into our triplist. Note that we must take into account the important
+        # subtlety that if multiple trips in the requested $or set have the same geometry, it will only be returned
+        # once, which means that we can't expect the indices returned by our request to match the indices of our
+        # geometry series! Instead we match them by key, in either orientation.
+        missing = 0
+        for trip in regular_trips:
+            start_end = (trip['properties']['start station id'], trip['properties']['end station id'])
+            if start_end in database_geometry_coordinates:
+                trip['geometry']['coordinates'] = database_geometry_coordinates[start_end]
+            elif start_end[::-1] in database_geometry_coordinates:
+                trip['geometry']['coordinates'] = database_geometry_coordinates[start_end[::-1]][::-1]
+            else:
+                missing += 1
+        if missing:
+            # This is expected while the data storage layer is being built, but not once it is full.
+            warnings.warn("{0} trips are missing their geometry; see `integrity_verifier.py`.".format(missing))
+        for trip in trips:
+            del trip['_id']
+        return trips
+
+    def get_trip_by_id(self, tripid):
+        """
+        Returns a trip selected by its ID.
+
+        If the trip is missing this method returns None.
+        """
+        trip = self.client['citibike']['citibike-trips'].find_one({"properties.tripid": tripid})
+        if trip:
+            # Trips whose geometry is missing in both orientations are returned without it, as in `get_trips_by_ids`.
+            return self.attach_geometries([trip])[0]
+        else:
+            return None
+
+    def get_station_bikeset(self, station_id, mode, start=None, stop=None):
+        """
+        This is it, folks---this is the core method which gets called when the front-end requests a station bikeset
+        off of an id. Everything else that's been implemented here is in support of this ultimate end goal.
+
+        If start and stop times are given, only the trips active during that time window are returned. This lets
+        animation playback fetch the current time slice instead of the whole bikeset.
+        """
+        if start is not None and stop is not None:
+            return self.get_trips_in_window(start, stop, station_id=station_id, mode=mode)
+        return self.get_trips_by_ids(self.get_station_tripset(station_id, mode))
+
+    def get_station_tripset(self, station_id, mode):
+        """
+        Returns the ids of the trips in a station's tripset, e.g. its "outbound bike trip indices".
+        """
+        return self.client['citibike']['station-indices'].find_one({'station id': str(station_id)})['tripsets'][mode]
+
+    # UTILITY
+    def build_spatial_index(self, station_metadata="../data/final/june_22_station_metadata.csv"):
+        """
+        Builds the in-memory spatial indices over station locations, read from the given station metadata file, and
+        over the bounding boxes of the geometries in the "trip-geometries" store.
+
+        This happens automatically the first time a spatial query is made. Call it again to pick up new geometries.
+        """
+        spatial = _import_sibling('spatial')
+        self.station_index = spatial.StationIndex.from_metadata(station_metadata)
+        self.geometry_index = spatial.GeometryIndex.from_geometries(self.client['citibike']['trip-geometries'].find(
+            {}, {'start station id': 1, 'end station id': 1, 'coordinates': 1}))
+
+    def _trip_query(self, start=None, stop=None, station_id=None, mode=None, tripset=None):
+        """
+        Returns the query selecting the trips active between the start and stop times, if given, and in the given
+        tripset or station tripset, if given.
+        """
+        query = dict()
+        if start is not None and stop is not None:
+            query.update(self._window_query(start, stop))
+        if station_id is not None:
+            tripset = self.get_station_tripset(station_id, mode)
+        if tripset is not None:
+            query['properties.tripid'] = {'$in': tripset}
+        return query
+
+    def _window_query(self, start, stop):
+        """
+        Returns the query selecting the trips active at some point between the start and stop times.
+        """
+        start = self._to_epoch(start)
+        stop = self._to_epoch(stop)
+        # A trip is active in the window if it starts before the window ends and stops after the window starts.
+        query = {'properties.startepoch': {'$lt': stop}, 'properties.stopepoch': {'$gt': start}}
+        # No trip is longer than the longest one, so none which started any earlier than that can still be active.
+        # This lower bound keeps the (startepoch, stopepoch) index scan to the window, however much data is stored.
+        max_trip_duration = self.get_max_trip_duration()
+        if max_trip_duration is not None:
+            query['properties.startepoch']['$gte'] = start - max_trip_duration
+        return query
+
+    # The time formats of the dataset, which `_to_epoch` parses without help from pandas.
+    time_formats = ["%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S"]
+
+    def _to_epoch(self, time):
+        """
+        Converts a time into epoch seconds of a type that MongoDB can encode, as `trip_model.to_epoch` does.
+
+        Numbers (numpy scalars included), naive datetimes, and strings in one of the `time_formats` are converted
+        here, so that time window queries on the read path do not import pandas. Anything else is handed to
+        `trip_model.to_epoch`.
+        """
+        if isinstance(time, numbers.Integral):
+            return int(time)
+        if isinstance(time, numbers.Number):
+            return float(time)
+        if isinstance(time, str):
+            for time_format in self.time_formats:
+                try:
+                    time = datetime.strptime(time, time_format)
+                    break
+                except ValueError:
+                    continue
+        if isinstance(time, datetime) and time.tzinfo is None:
+            # Trip times are naive, and are converted as if they were UTC.
+            return calendar.timegm(time.timetuple())
+        return _import_sibling('trip_model').to_epoch(time)
+
+    def delete_all(self):
+        """
+        Flushes the entire database down the toilet. Only useful for testing. Don't do this actually.
+        """
+        self.client['citibike']['citibike-trips'].delete_many({})
+        self.client['citibike']['citibike-trip-ids'].delete_many({})
+        self.client['citibike']['trip-geometries'].delete_many({})
+        self.client['citibike']['station-indices'].delete_many({})
+
+    def get_all_trip_ids(self):
+        """
+        Returns all of the trip ids stored in the "citibike-trip-ids" store, including any still in the single-document
+        list of older data stores (see `update_trip_id_list`).
+
+        Note: this does not associate any geometries with those trips!
+        """
+        ids = self.client['citibike']['citibike-trip-ids']
+        listed = [document['tripid'] for document in ids.find({'tripid': {'$exists': True}}, {'_id': 0, 'tripid': 1})]
+        legacy = ids.find_one({'name': 'id-list'})
+        if legacy:
+            listed = sorted(set(listed).union(legacy['id-list']))
+        return listed
+
+    def get_max_trip_id(self):
+        """
+        Returns the largest trip id in the "citibike-trips" store, or -1 if it is empty.
+        """
+        trip = self.client['citibike']['citibike-trips'].find_one({}, {'_id': 0, 'properties.tripid': 1},
+                                                                 sort=[('properties.tripid', pymongo.DESCENDING)])
+        return trip['properties']['tripid'] if trip else -1
+
+    def sample(self, n):
+        """
+        Samples n random trips from the data store.
+        """
+        samples = []
+        r_s = random.sample(self.get_all_trip_ids(), n)
+        for r in r_s:
+            samples.append(self.get_trip_by_id(r))
+        return samples
+
+    def iter_all(self):
+        """
+        Returns an iterator cursor which lets you do something to every object in the datastore.
+        """
+        return self.client['citibike']['citibike-trips'].find({})
+
+    def iter_trip_batches(self, start=None, stop=None, station_id=None, mode=None, tripset=None, batch_size=1000):
+        """
+        Streams trips out of the datastore in lists of up to batch_size trips, with geometry attached.
+
+        Unlike `iter_all`, which returns trips without their geometries, every batch has its geometries joined in with
+        a single request. Trips may be filtered by time window, station tripset, or trip ids, as in
+        `get_trips_in_window`; by default every trip is returned. Only one batch is held in memory at a time.
+        """
+        query = self._trip_query(start=start, stop=stop, station_id=station_id, mode=mode, tripset=tripset)
+        batch = []
+        for trip in self.client['citibike']['citibike-trips'].find(query, batch_size=batch_size):
+            batch.append(trip)
+            if len(batch) == batch_size:
+                yield self.attach_geometries(batch)
+                batch = []
+        if batch:
+            yield self.attach_geometries(batch)
+
+    def replace_trip(self, tripid, new_repr):
+        """
+        Replaces the trip in question with another.
+        """
+        return self.client['citibike']['citibike-trips'].update_one({'properties.tripid': tripid}, {"$set": new_repr},
+                                                                    upsert=False)
+
+    def close(self):
+        """
+        Close the database (pass-through wrapper).
+        """
+        self.client.close()
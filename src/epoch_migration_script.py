@@ -0,0 +1,65 @@
+"""
+Runnable script which adds the numeric `startepoch` and `stopepoch` trip times, and the `station pair` key, to trips
+written to the database before those fields existed. Time window queries (see `DataStore.get_trips_in_window`) run
+against the times, and viewport queries (see `DataStore.get_trips_in_bbox`) against the key, so trips without them
+never show up in either.
+
+Trips are read and updated in batches; running it again only touches trips which are still missing the fields. The
+script also records the longest trip duration in the data store, which time window queries use to bound their index
+scans; run it once on any data store written before that was recorded.
+"""
+
+import citibike_trips
+import pymongo
+
+
+def main():
+    uri = input("Enter a valid MongoDB connection URI: ")
+    db = citibike_trips.DataStore(uri=uri)
+    batch_size = 10000
+    try:
+        trips = db.client['citibike']['citibike-trips']
+        cursor = trips.find({'$or': [{'properties.startepoch': {'$exists': False}},
+                                     {'properties.station pair': {'$exists': False}}]},
+                            {'properties.starttime': 1, 'properties.stoptime': 1,
+                             'properties.start station id': 1, 'properties.end station id': 1}, batch_size=batch_size)
+        n = 0
+        batch = []
+        for trip in cursor:
+            batch.append(trip)
+            if len(batch) == batch_size:
+                n += migrate(db, trips, batch)
+                batch = []
+        n += migrate(db, trips, batch)
+        print("Migrated {0} trips.".format(n))
+        longest = list(trips.aggregate([{'$group': {'_id': None, 'seconds': {'$max': {
+            '$subtract': ['$properties.stopepoch', '$properties.startepoch']}}}}]))
+        if longest and longest[0]['seconds'] is not None:
+            db.client['citibike']['citibike-trip-ids'].update_one({'name': 'max-trip-duration'},
+                                                                  {'$max': {'seconds': int(longest[0]['seconds'])}},
+                                                                  upsert=True)
+            print("Recorded a longest trip duration of {0} seconds.".format(int(longest[0]['seconds'])))
+    finally:
+        db.close()
+
+
+def migrate(db, trips, batch):
+    """
+    Writes the epoch times and station pair keys of a batch of trips in a single bulk request. Returns the number of
+    trips written.
+    """
+    if not batch:
+        return 0
+    starts = citibike_trips.to_epoch([trip['properties']['starttime'] for trip in batch])
+    stops = citibike_trips.to_epoch([trip['properties']['stoptime'] for trip in batch])
+    trips.bulk_write([pymongo.UpdateOne({'_id': trip['_id']}, {'$set': {
+        'properties.startepoch': int(start),
+        'properties.stopepoch': int(stop),
+        'properties.station pair': db.station_pair(trip['properties']['start station id'],
+                                                   trip['properties']['end station id'])
+    }}) for trip, start, stop in zip(batch, starts, stops)], ordered=False)
+    return len(batch)
+
+
+if __name__ == '__main__':
+    main()
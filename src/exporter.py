@@ -0,0 +1,189 @@
+"""
+Runnable script which exports trips out of the datastore, with their geometries, into a file.
+
+Trips are streamed out of the datastore in batches, and each batch is encoded by a pool of worker processes while the
+next one is being read, so exports of millions of trips run in bounded memory at about the speed of the disk. The
+whole datastore may be exported, or just a station tripset, a time window, or a list of trip ids.
+
+Three formats are supported:
+
+* `ndjson`: one GeoJSON Feature per line.
+* `geojson`: a single GeoJSON FeatureCollection.
+* `parquet`: a columnar Parquet file with one column per trip property, plus the coordinates. Requires `pyarrow`.
+  Columns follow `parquet_columns`, whichever properties the trips actually have.
+
+The text formats may be compressed with gzip, bz2, or xz; Parquet files are compressed internally, with gzip, brotli,
+zstd, or snappy.
+
+Example usage:
+
+    python exporter.py trips.ndjson.gz --compression gzip --start "6/22/2016 08:00:00" --stop "6/22/2016 09:00:00"
+"""
+
+import citibike_trips
+import argparse
+import bz2
+import collections
+import gzip
+import json
+import lzma
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+openers = {None: open, 'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+# The Parquet columns and their types: every trip property (see `TripBatch` and `RebalancingTrip`), plus coordinates.
+parquet_columns = {
+    'tripid': 'int64', 'bikeid': 'float64', 'usertype': 'string', 'birth year': 'float64', 'gender': 'float64',
+    'starttime': 'string', 'stoptime': 'string', 'startepoch': 'int64', 'stopepoch': 'int64', 'tripduration': 'float64',
+    'start station id': 'float64', 'start station name': 'string', 'start station latitude': 'float64',
+    'start station longitude': 'float64', 'end station id': 'float64', 'end station name': 'string',
+    'end station latitude': 'float64', 'end station longitude': 'float64', 'coordinates': 'path'
+}
+
+
+def encode_ndjson(trips):
+    return ''.join(json.dumps(trip) + '\n' for trip in trips).encode('utf-8')
+
+
+def encode_geojson(trips):
+    # Features only; `export` writes the surrounding FeatureCollection and the commas in between batches.
+    return ',\n'.join(json.dumps(trip) for trip in trips).encode('utf-8')
+
+
+def encode_columns(trips):
+    # Properties a trip is missing, e.g. the epoch times of trips written before they existed, are left null.
+    columns = {name: [trip['properties'].get(name) for trip in trips] for name in parquet_columns
+               if name != 'coordinates'}
+    for name, kind in parquet_columns.items():
+        if kind == 'string':
+            columns[name] = [None if value is None else str(value) for value in columns[name]]
+    columns['coordinates'] = [trip['geometry']['coordinates'] for trip in trips]
+    return columns
+
+
+class _ParquetWriter:
+    """
+    Class encoding a Parquet file written one batch of trips at a time, with one row group per batch.
+    """
+    def __init__(self, filename, compression):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Exporting to Parquet requires pyarrow. Try `pip install pyarrow`.")
+        self.pyarrow = pyarrow
+        # The schema is fixed up front rather than inferred, since no one batch is guaranteed to have every property,
+        # or a single non-empty geometry.
+        types = {'int64': pyarrow.int64(), 'float64': pyarrow.float64(), 'string': pyarrow.string(),
+                 'path': pyarrow.list_(pyarrow.list_(pyarrow.float64()))}
+        self.schema = pyarrow.schema([(name, types[kind]) for name, kind in parquet_columns.items()])
+        self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema, compression=compression or 'snappy')
+
+    def write(self, columns):
+        self.writer.write_table(self.pyarrow.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def export(datastore, filename, fmt='ndjson', compression=None, batch_size=1000, workers=None, **filters):
+    """
+    Exports trips out of the datastore, with their geometries, into a file.
+
+    Parameters
+    ----------
+    datastore: DataStore
+        The datastore to export from.
+    filename: str
+        The file to write to.
+    fmt: str
+        The format to write: 'ndjson', 'geojson', or 'parquet'.
+    compression: str
+        The compression to use, if any: 'gzip', 'bz2', or 'xz' for the text formats, or any of the codecs supported by
+        Parquet for 'parquet'.
+    batch_size: int
+        The number of trips read out of the datastore, encoded, and written at a time.
+    workers: int
+        The number of worker processes which encode batches. Defaults to one per CPU; use 0 to encode in this process.
+    filters:
+        Any of the filters accepted by `DataStore.iter_trip_batches`: start and stop, station_id and mode, or tripset.
+
+    Returns
+    -------
+    The number of trips exported.
+    """
+    encoder = {'ndjson': encode_ndjson, 'geojson': encode_geojson, 'parquet': encode_columns}[fmt]
+    workers = os.cpu_count() if workers is None else workers
+    if fmt == 'parquet':
+        f = _ParquetWriter(filename, compression)
+    else:
+        f = openers[compression](filename, 'wb')
+    n = 0
+    written = 0
+
+    def write(chunk):
+        nonlocal written
+        if fmt == 'geojson' and written:
+            f.write(b',\n')
+        f.write(chunk)
+        written += 1
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers else None
+    try:
+        if fmt == 'geojson':
+            f.write(b'{"type": "FeatureCollection", "features": [\n')
+        # Keep at most two batches per worker in flight, so memory use stays bounded however many trips there are.
+        pending = collections.deque()
+        for trips in datastore.iter_trip_batches(batch_size=batch_size, **filters):
+            n += len(trips)
+            if executor is None:
+                write(encoder(trips))
+                continue
+            pending.append(executor.submit(encoder, trips))
+            if len(pending) >= 2 * workers:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+        if fmt == 'geojson':
+            f.write(b'\n]}\n')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        f.close()
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export trips out of the datastore, with their geometries.")
+    parser.add_argument('filename', help="The file to write to.")
+    parser.add_argument('--uri', help="A valid MongoDB connection URI. Prompted for if not given.")
+    parser.add_argument('--format', default='ndjson', choices=['ndjson', 'geojson', 'parquet'], dest='fmt')
+    parser.add_argument('--compression', help="gzip, bz2, or xz; or a Parquet codec for Parquet files.")
+    parser.add_argument('--station', type=int, help="Only export the trips in this station's tripset.")
+    parser.add_argument('--mode', default='outbound bike trip indices', help="The station tripset to export.")
+    parser.add_argument('--start', help="Only export trips active after this time, e.g. '6/22/2016 08:00:00'.")
+    parser.add_argument('--stop', help="Only export trips active before this time.")
+    parser.add_argument('--ids', help="Only export these trips, given as a comma-separated list of trip ids.")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, help="Number of encoding processes. Defaults to one per CPU.")
+    args = parser.parse_args()
+    uri = args.uri or input("Enter a valid MongoDB connection URI: ")
+    db = citibike_trips.DataStore(uri=uri)
+    filters = dict()
+    if args.station is not None:
+        filters.update(station_id=args.station, mode=args.mode)
+    if args.start is not None and args.stop is not None:
+        filters.update(start=args.start, stop=args.stop)
+    if args.ids is not None:
+        filters.update(tripset=[int(tripid) for tripid in args.ids.split(',')])
+    try:
+        n = export(db, args.filename, fmt=args.fmt, compression=args.compression, batch_size=args.batch_size,
+                   workers=args.workers, **filters)
+        print("Exported {0} trips.".format(n))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
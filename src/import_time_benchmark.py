@@ -0,0 +1,69 @@
+"""
+Runnable script which benchmarks how long the read path of the library (`citibike_trips.DataStore`) takes to import
+in a fresh interpreter, as it does every time a web worker starts up.
+
+The read path cannot do without pymongo, so it is timed against importing pymongo alone. The benchmark fails if the
+read path pulls in any of the heavy components of the library, or takes more than `budget` seconds on top of pymongo.
+It also fails if building a time window query, as time-sliced bikeset requests do, pulls them in.
+"""
+
+import os
+import subprocess
+import sys
+import json
+
+
+read_path = "import citibike_trips; citibike_trips.DataStore"
+# A time window query, built without connecting to a database.
+window_path = read_path + ("; db = citibike_trips.DataStore.__new__(citibike_trips.DataStore); "
+                           "db.max_trip_duration = 3600; "
+                           "db._window_query('6/22/2016 08:00:00', 1466586000)")
+heavy_modules = ['pandas', 'numpy', 'googlemaps', 'requests', 'geojson', 'polyline']
+budget = 0.02
+
+
+def run(code):
+    """
+    Runs the given code in a fresh interpreter from this directory, returning whatever it prints.
+    """
+    return subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(statement, runs=10):
+    """
+    Returns the median time, in seconds, that the given import statement takes in a fresh interpreter.
+    """
+    code = "import time; t = time.perf_counter(); {0}; print(time.perf_counter() - t)".format(statement)
+    times = sorted(float(run(code)) for _ in range(runs))
+    return times[len(times) // 2]
+
+
+def loaded_heavy_modules(statement):
+    """
+    Returns the heavy modules which are loaded after running the given import statement in a fresh interpreter.
+    """
+    code = "import sys, json; {0}; print(json.dumps([m for m in {1!r} if m in sys.modules]))".format(
+        statement, heavy_modules)
+    return json.loads(run(code))
+
+
+def main():
+    baseline = time_import("import pymongo")
+    read = time_import(read_path)
+    full = time_import("import citibike_trips; citibike_trips.TripBatch; citibike_trips.initialize_google_client")
+    print("pymongo alone:       {0:.1f} ms".format(baseline * 1000))
+    print("read path:           {0:.1f} ms".format(read * 1000))
+    print("everything:          {0:.1f} ms".format(full * 1000))
+    loaded = loaded_heavy_modules(read_path)
+    if loaded:
+        sys.exit("The read path imports {0}.".format(", ".join(loaded)))
+    loaded = loaded_heavy_modules(window_path)
+    if loaded:
+        sys.exit("Time window queries import {0}.".format(", ".join(loaded)))
+    if read - baseline > budget:
+        sys.exit("The read path takes {0:.1f} ms on top of pymongo, over the {1:.1f} ms budget.".format(
+            (read - baseline) * 1000, budget * 1000))
+
+
+if __name__ == '__main__':
+    main()
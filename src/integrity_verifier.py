@@ -0,0 +1,294 @@
+"""
+Runnable script which audits the data store for consistency, and optionally repairs what it finds, in bulk.
+
+Notebook 10 checks the integrity of the station metadata by hand; this checks that of the data store itself. The four
+stores which make it up are expected to agree with one another:
+
+* Every trip id in a station tripset in "station-indices" is the id of a trip in "citibike-trips".
+* Every trip in "citibike-trips", rebalancing trips aside, has its geometry stored in "trip-geometries", in one
+  orientation or the other.
+* Every geometry in "trip-geometries" is the geometry of at least one trip.
+* The id list in "citibike-trip-ids" is exactly the set of ids of the trips in "citibike-trips".
+
+Each store is read once, with a projection down to the fields that are checked, in large batches, and the checks are
+done with numpy set operations, so auditing a million-trip store takes minutes rather than a request per document.
+Repairs are likewise written in a handful of bulk requests. Trips missing geometry can only be repaired by geocoding
+them, which takes a Google Maps client; without one they are only reported. Orphan geometries are only deleted on
+request, as an unfinished pipeline run leaves behind geometries whose trips are yet to be inserted.
+"""
+
+import citibike_trips
+import pymongo
+import numpy as np
+
+
+def scan_trip_ids(db, batch_size=100000):
+    """
+    Returns the array of the ids of every trip in the "citibike-trips" store, duplicates included.
+    """
+    cursor = db.client['citibike']['citibike-trips'].find({}, {'_id': 0, 'properties.tripid': 1},
+                                                            batch_size=batch_size)
+    return np.fromiter((trip['properties']['tripid'] for trip in cursor), dtype=np.int64)
+
+
+def scan_trip_pairs(db):
+    """
+    Returns the (start station id, end station id) pairs of the bike trips in the "citibike-trips" store, with the
+    number of trips and the station coordinates of each, grouped by the database.
+    """
+    pipeline = [
+        {'$match': {'properties.usertype': {'$ne': 'Rebalancing'}}},
+        {'$group': {'_id': {'start': '$properties.start station id', 'end': '$properties.end station id'},
+                    'trips': {'$sum': 1},
+                    'start latitude': {'$first': '$properties.start station latitude'},
+                    'start longitude': {'$first': '$properties.start station longitude'},
+                    'end latitude': {'$first': '$properties.end station latitude'},
+                    'end longitude': {'$first': '$properties.end station longitude'}}}
+    ]
+    return list(db.client['citibike']['citibike-trips'].aggregate(pipeline, allowDiskUse=True))
+
+
+def scan_geometries(db, batch_size=100000):
+    """
+    Returns the (MongoDB id, start station id, end station id) of every geometry in the "trip-geometries" store,
+    without the coordinates.
+    """
+    cursor = db.client['citibike']['trip-geometries'].find({}, {'start station id': 1, 'end station id': 1},
+                                                            batch_size=batch_size)
+    return [(geom['_id'], geom['start station id'], geom['end station id']) for geom in cursor]
+
+
+def find_drift(stored, listed):
+    """
+    Compares the trip ids stored in "citibike-trips" with those in the id list. Returns a tuple of the sorted arrays
+    of the ids which are stored but not listed, and of those which are listed but not stored.
+    """
+    stored = np.asarray(stored, dtype=np.int64)
+    listed = np.asarray(listed, dtype=np.int64)
+    return np.setdiff1d(stored, listed), np.setdiff1d(listed, stored)
+
+
+def find_dangling(indices, stored):
+    """
+    Finds the trip ids in station tripsets which are not the ids of stored trips.
+
+    Parameters
+    ----------
+    indices: iterable
+        Documents from the "station-indices" store, of the form {'station id': ..., 'tripsets': {name: [trip ids]}}.
+    stored: np.ndarray
+        The ids of the trips in the "citibike-trips" store.
+
+    Returns
+    -------
+    A dict of the form {station id: {tripset name: [trip ids]}}, containing only the tripsets with dangling ids.
+    """
+    indices = [(index['station id'], name, tripset) for index in indices
+               for name, tripset in index.get('tripsets', dict()).items()]
+    if not indices:
+        return dict()
+    # Check every tripset at once: flatten them into one array, and split the result back up afterwards.
+    ids = np.concatenate([np.asarray(tripset, dtype=np.int64) for _, _, tripset in indices])
+    dangling = ~np.isin(ids, stored)
+    splits = np.cumsum([len(tripset) for _, _, tripset in indices])[:-1]
+    result = dict()
+    for (station_id, name, _), tripset, mask in zip(indices, np.split(ids, splits), np.split(dangling, splits)):
+        if mask.any():
+            result.setdefault(station_id, dict())[name] = tripset[mask].tolist()
+    return result
+
+
+def match_geometries(trip_pairs, geometry_pairs):
+    """
+    Matches the station pairs of the stored trips against those of the stored geometries, in either orientation.
+    Returns a tuple of the positions of the trip pairs which have no geometry, and of the geometry pairs which belong
+    to no trip.
+    """
+    trip_pairs = [tuple(pair) for pair in trip_pairs]
+    geometry_pairs = [tuple(pair) for pair in geometry_pairs]
+    stored = set(geometry_pairs) | {pair[::-1] for pair in geometry_pairs}
+    used = set(trip_pairs) | {pair[::-1] for pair in trip_pairs}
+    missing = [i for i, pair in enumerate(trip_pairs) if pair not in stored]
+    orphans = [i for i, pair in enumerate(geometry_pairs) if pair not in used]
+    return missing, orphans
+
+
+def verify(db, batch_size=100000):
+    """
+    Audits the data store.
+
+    Parameters
+    ----------
+    db: DataStore
+        The data store to audit.
+    batch_size: int
+        The number of documents read per request.
+
+    Returns
+    -------
+    A dict report, with the following entries:
+
+    * "trips": the number of trips stored.
+    * "duplicate trip ids": the ids shared by more than one stored trip. These are reported but not repaired.
+    * "unlisted trip ids" and "stale trip ids": the stored trip ids missing from the id list, and the ids in the id
+      list which are not stored.
+    * "legacy id list": whether the id list is still kept in the single document older data stores used (see
+      `DataStore.update_trip_id_list`).
+    * "dangling tripset ids": the trip ids in station tripsets which are not stored, as returned by `find_dangling`.
+    * "missing geometries": the station pairs of the trips which are missing geometry, as returned by
+      `scan_trip_pairs`, and "trips missing geometry", the number of trips they account for.
+    * "orphan geometries": the (MongoDB id, start station id, end station id) of the geometries no trip uses.
+    """
+    stored = scan_trip_ids(db, batch_size=batch_size)
+    ids, counts = np.unique(stored, return_counts=True)
+    unlisted, stale = find_drift(ids, db.get_all_trip_ids())
+    legacy = db.client['citibike']['citibike-trip-ids'].find_one({'name': 'id-list'}, {'_id': 1})
+    indices = db.client['citibike']['station-indices'].find({}, {'_id': 0, 'station id': 1, 'tripsets': 1},
+                                                            batch_size=batch_size)
+    dangling = find_dangling(indices, ids)
+    trip_pairs = scan_trip_pairs(db)
+    geometries = scan_geometries(db, batch_size=batch_size)
+    missing, orphans = match_geometries([(pair['_id']['start'], pair['_id']['end']) for pair in trip_pairs],
+                                        [(sid, eid) for _, sid, eid in geometries])
+    return {
+        'trips': len(stored),
+        'duplicate trip ids': ids[counts > 1].tolist(),
+        'unlisted trip ids': unlisted.tolist(),
+        'stale trip ids': stale.tolist(),
+        'legacy id list': legacy is not None,
+        'dangling tripset ids': dangling,
+        'missing geometries': [trip_pairs[i] for i in missing],
+        'trips missing geometry': sum(trip_pairs[i]['trips'] for i in missing),
+        'orphan geometries': [geometries[i] for i in orphans]
+    }
+
+
+def repair(db, report, client=None, limit=2500, batch_size=10000, delete_orphans=False):
+    """
+    Repairs the problems found by `verify`, in bulk.
+
+    Dangling ids are pulled out of their station tripsets, and the id list is brought in line with the stored trips,
+    moving any ids still in the legacy single-document list to one document apiece. If a Google Maps client is given,
+    the missing geometries are geocoded and inserted; otherwise they are left as they are.
+
+    Orphan geometries are only deleted if asked for. The pipeline geocodes a partition's geometries before it inserts
+    its trips (see `pipeline.py`), so while a pipeline run is unfinished its geometries look orphaned, and deleting
+    them would throw away paid-for Directions API queries.
+
+    Parameters
+    ----------
+    db: DataStore
+        The data store to repair.
+    report: dict
+        The report returned by `verify`.
+    client: googlemaps.Client
+        A `googlemaps.Client` instance, as returned by e.g. `import_google_credentials()`, or None.
+    limit: int
+        The maximum number of Google Directions API queries to make. Geometries past the limit are left for the next
+        run.
+    batch_size: int
+        The number of documents written per request.
+    delete_orphans: bool
+        Whether to delete the orphan geometries. Only do this when no pipeline run is unfinished.
+
+    Returns
+    -------
+    A tuple of a dict of the number of each kind of problem repaired, the list of the (start station id, end station
+    id) pairs which could not be geocoded, and the number of missing geometries left for the next run.
+    """
+    repaired = {'dangling tripset ids': 0, 'orphan geometries': 0, 'trip id list': 0, 'missing geometries': 0}
+    requests = [pymongo.UpdateOne({'station id': station_id},
+                                  {'$pullAll': {'tripsets.{0}'.format(name): ids for name, ids in tripsets.items()}})
+                for station_id, tripsets in report['dangling tripset ids'].items()]
+    if requests:
+        db.client['citibike']['station-indices'].bulk_write(requests, ordered=False)
+        repaired['dangling tripset ids'] = sum(len(ids) for tripsets in report['dangling tripset ids'].values()
+                                               for ids in tripsets.values())
+    orphans = [_id for _id, _, _ in report['orphan geometries']] if delete_orphans else []
+    for i in range(0, len(orphans), batch_size):
+        result = db.client['citibike']['trip-geometries'].delete_many({'_id': {'$in': orphans[i:i + batch_size]}})
+        repaired['orphan geometries'] += result.deleted_count
+    if report['unlisted trip ids'] or report['stale trip ids'] or report.get('legacy id list'):
+        id_store = db.client['citibike']['citibike-trip-ids']
+        stale = report['stale trip ids']
+        legacy = id_store.find_one({'name': 'id-list'}) or {'id-list': []}
+        ids = report['unlisted trip ids'] + list(set(legacy['id-list']).difference(stale))
+        for i in range(0, len(ids), batch_size):
+            db.update_trip_id_list(ids[i:i + batch_size])
+        for i in range(0, len(stale), batch_size):
+            id_store.delete_many({'tripid': {'$in': stale[i:i + batch_size]}})
+        id_store.delete_one({'name': 'id-list'})
+        repaired['trip id list'] = len(report['unlisted trip ids']) + len(stale)
+    failed = []
+    pending = 0
+    if client is not None:
+        # A geometry serves both orientations of its station pair, so each pair only needs geocoding once.
+        pairs = dict()
+        for pair in report['missing geometries']:
+            pairs.setdefault(frozenset([pair['_id']['start'], pair['_id']['end']]), pair)
+        pending = len(pairs)
+        geometries = []
+        for pair in pairs.values():
+            if limit <= 0:
+                break
+            limit -= 1
+            pending -= 1
+            try:
+                coordinates = citibike_trips.BikeTrip.get_bike_trip_path(
+                    [pair['start latitude'], pair['start longitude']], [pair['end latitude'], pair['end longitude']],
+                    client)
+            # Sometimes a trip with impossible coordinates is passed---e.g. it appears that a few CitiBikes take a
+            # ferry ride between Governer's Island and mainland Manhattan.
+            except Exception:
+                failed.append((pair['_id']['start'], pair['_id']['end']))
+                continue
+            geometries.append({'start station id': pair['_id']['start'], 'end station id': pair['_id']['end'],
+                               'coordinates': coordinates})
+            # Write as we go, so that an interrupted run keeps the geometries it has already paid for.
+            if len(geometries) == batch_size:
+                db.client['citibike']['trip-geometries'].insert_many(geometries)
+                repaired['missing geometries'] += len(geometries)
+                geometries = []
+        if geometries:
+            db.client['citibike']['trip-geometries'].insert_many(geometries)
+            repaired['missing geometries'] += len(geometries)
+    return repaired, failed, pending
+
+
+def main():
+    uri = input("Enter a valid MongoDB connection URI: ")
+    db = citibike_trips.DataStore(uri=uri)
+    try:
+        report = verify(db)
+        print("Audited {0} trips.".format(report['trips']))
+        print("Duplicate trip ids: {0}".format(len(report['duplicate trip ids'])))
+        print("Trip ids missing from the id list: {0}".format(len(report['unlisted trip ids'])))
+        print("Trip ids in the id list which are not stored: {0}".format(len(report['stale trip ids'])))
+        if report['legacy id list']:
+            print("The id list is still kept in a single document, and will be migrated on repair.")
+        print("Dangling tripset ids: {0}".format(sum(len(ids) for tripsets in report['dangling tripset ids'].values()
+                                                     for ids in tripsets.values())))
+        print("Trips missing geometry: {0} (across {1} station pairs)".format(report['trips missing geometry'],
+                                                                           len(report['missing geometries'])))
+        print("Orphan geometries: {0}".format(len(report['orphan geometries'])))
+        if input("Repair these problems? (y/n): ").strip().lower() == 'y':
+            credentials = input("Enter a Google Maps API key file to geocode missing geometries (or leave blank): ")
+            client = citibike_trips.initialize_google_client(filename=credentials) if credentials else None
+            limit = int(input("How many geometries do you want to geocode (daily API limit is 2500): ")) \
+                if client is not None else 0
+            delete_orphans = bool(report['orphan geometries']) and input(
+                "Delete the orphan geometries? Only do this if no pipeline run is unfinished, as the geometries it has "
+                "geocoded are not used by any trip until its trips are inserted. (y/n): ").strip().lower() == 'y'
+            repaired, failed, pending = repair(db, report, client=client, limit=limit, delete_orphans=delete_orphans)
+            for problem, n in repaired.items():
+                print("Repaired {0}: {1}".format(problem, n))
+            for start, end in failed:
+                print("Could not geocode the trip from station {0} to station {1}.".format(start, end))
+            if pending:
+                print("{0} missing geometries are left to geocode. Run again to continue.".format(pending))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+"""
+Runnable script which processes the CitiBike trips for a range of days into the data store which serves the front-end
+visualization. This generalizes the single-day June 22 workflow spread across notebook 06, notebook 11 and
+`data_chunker.py`.
+
+Every day is a partition which goes through five stages, in order: load, rebalancing, geocoding, insert, and indices.
+Progress is checkpointed to disk per stage and per partition, so a job which gets killed (or which runs out of daily
+Google Directions API queries, see `data_chunker.py`) picks up where it left off the next time it is run. Days which
+have already been processed are never revisited, geometries already in the data store are reused, and only the
+indices of the stations a new day touches are updated.
+"""
+
+import citibike_trips
+import googlemaps
+import json
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+
+def detect_rebalancing_trips(trips):
+    """
+    Returns the rebalancing trips implied by a set of trips. A bike whose next trip starts somewhere other than where
+    its last trip ended must have been moved by a rebalancing van in between the two.
+
+    This is a vectorized equivalent of running `RebalancingTrip.rebalanced` on every pair of adjacent trips, as
+    notebook 06 does. The trips returned span the entire gap between the two surrounding trips; the geocoding stage
+    narrows them down once a time estimate for the van trip is available.
+
+    Parameters
+    ----------
+    trips: pd.DataFrame
+        Trips in the raw dataset format, with `starttime` and `stoptime` parsed as datetimes.
+
+    Returns
+    -------
+    A `pandas` DataFrame of rebalancing trips in the preprocessed format expected by `RebalancingTrip`, without ids.
+    """
+    ordered = trips.sort_values(by=['bikeid', 'starttime'])
+    before = ordered.iloc[:-1]
+    after = ordered.iloc[1:]
+    rebalanced = (before['bikeid'].values == after['bikeid'].values) & \
+                 (before['end station id'].values != after['start station id'].values)
+    before = before[rebalanced]
+    after = after[rebalanced]
+    return pd.DataFrame({
+        'tripduration': (after['starttime'].values - before['stoptime'].values) / np.timedelta64(1, 's'),
+        'starttime': before['stoptime'].values,
+        'stoptime': after['starttime'].values,
+        'start station id': before['end station id'].values,
+        'start station name': before['end station name'].values,
+        'start station latitude': before['end station latitude'].values,
+        'start station longitude': before['end station longitude'].values,
+        'end station id': after['start station id'].values,
+        'end station name': after['start station name'].values,
+        'end station latitude': after['start station latitude'].values,
+        'end station longitude': after['start station longitude'].values,
+        'bikeid': before['bikeid'].values,
+        'usertype': 'Rebalancing',
+        'birth year': 0,
+        'gender': 3
+    })
+
+
+def build_station_indices(trips):
+    """
+    Returns the station trip indices for a set of trips, in the format expected by `DataStore.update_station_indices`.
+
+    This is a vectorized equivalent of the per-bike and per-station loops in notebook 11. A bike's day starts at the
+    start station of its first trip and ends at the end station of its last one.
+
+    Parameters
+    ----------
+    trips: pd.DataFrame
+        Trips indexed by trip id, with `starttime` parsed as datetimes.
+
+    Returns
+    -------
+    A dict of the form {station id: {tripset name: [trip ids]}}.
+    """
+    ordered = trips.sort_values(by='starttime')
+    first_stations = ordered.groupby('bikeid')['start station id'].first()
+    last_stations = ordered.groupby('bikeid')['end station id'].last()
+    tripset_stations = {
+        'outbound bike trip indices': trips['bikeid'].map(first_stations),
+        'inbound bike trip indices': trips['bikeid'].map(last_stations),
+        'outgoing trip indices': trips['start station id'],
+        'incoming trip indices': trips['end station id']
+    }
+    indices = dict()
+    for name, stations in tripset_stations.items():
+        trip_ids = pd.Series(trips.index.values, index=stations.values)
+        for station_id, tripset in trip_ids.groupby(level=0):
+            indices.setdefault(str(int(station_id)), dict())[name] = tripset.values.tolist()
+    return indices
+
+
+class Checkpoints:
+    """
+    Class encoding the pipeline's on-disk record of progress.
+    """
+    def __init__(self, workdir):
+        """
+        Loads the checkpoints stored in the given working directory, if there are any.
+        """
+        self.filename = os.path.join(workdir, 'checkpoints.json')
+        if os.path.isfile(self.filename):
+            with open(self.filename) as f:
+                self.state = json.load(f)
+        else:
+            self.state = {'next trip id': None, 'partitions': {}}
+
+    def get(self, day, stage, default=None):
+        return self.state['partitions'].get(day, {}).get(stage, default)
+
+    def done(self, day, stage):
+        return self.get(day, stage) is True
+
+    def mark(self, day, stage, value=True):
+        self.state['partitions'].setdefault(day, {})[stage] = value
+        self.save()
+
+    def reserve_trip_ids(self, n):
+        """
+        Returns n fresh trip ids. The counter is persisted, so ids are never handed out twice.
+        """
+        start = self.state['next trip id']
+        self.state['next trip id'] = start + n
+        self.save()
+        return np.arange(start, start + n)
+
+    def save(self):
+        # Write and then rename, so that a job killed mid-write cannot leave a corrupted checkpoint file behind.
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump(self.state, f, indent=4)
+        os.replace(self.filename + '.tmp', self.filename)
+
+
+class Pipeline:
+    """
+    Class encoding the incremental, checkpointed multi-day ingestion pipeline.
+    """
+    stages = ['load', 'rebalancing', 'geocoding', 'insert', 'indices']
+
+    def __init__(self, datastore, client, workdir="../data/pipeline", limit=2500, chunksize=1000):
+        """
+        Parameters
+        ----------
+        datastore: DataStore
+            The data store being written to.
+        client: googlemaps.Client
+            A `googlemaps.Client` instance, as returned by e.g. `import_google_credentials()`.
+        workdir: str
+            The directory that intermediate partition data and checkpoints are kept in.
+        limit: int
+            The maximum number of Google Directions API queries to make in this run.
+        chunksize: int
+            The number of trips written to the data store at a time.
+        """
+        os.makedirs(workdir, exist_ok=True)
+        self.db = datastore
+        self.client = client
+        self.workdir = workdir
+        self.remaining_queries = limit
+        self.chunksize = chunksize
+        self.checkpoints = Checkpoints(workdir)
+        if self.checkpoints.state['next trip id'] is None:
+            self.checkpoints.state['next trip id'] = self.db.get_max_trip_id() + 1
+        self._raw_data = dict()
+
+    def run(self, start, end):
+        """
+        Runs every outstanding stage for every day from start to end (inclusive, as `datetime.date` objects).
+
+        Returns True if the whole date range is done, and False if the run stopped because it ran out of Google
+        Directions API queries.
+        """
+        day = start
+        while day <= end:
+            for stage in self.stages:
+                if not self.checkpoints.done(day.isoformat(), stage):
+                    if getattr(self, stage)(day) is False:
+                        return False
+                    self.checkpoints.mark(day.isoformat(), stage)
+            day += timedelta(days=1)
+        return True
+
+    # STAGES
+    def load(self, day):
+        """
+        Extracts the trips which start on the given day from the raw monthly data, and assigns them ids.
+
+        Trips are partitioned by start time alone, so a trip which crosses midnight belongs to the day it started on.
+
+        Each bike's last trip before this day, however long ago that was, is kept alongside, so that the rebalancing
+        stage can detect bikes which were moved while they were out of service. These come from a table of the last
+        trip of every bike seen so far, which is kept next to the checkpoints and carried forward from day to day, so
+        days are expected to be processed in order (as `run` does).
+        """
+        raw_data = self._raw_month(day)
+        trips = raw_data[raw_data['starttime'].dt.date == day].copy()
+        trips.index = self.checkpoints.reserve_trip_ids(len(trips))
+        self._write_trips(day, 'trips.csv', trips)
+        # A load which was killed after taking its snapshot of the table must not take it again, since by then the
+        # table may already include this day's trips.
+        if os.path.isfile(self._partition_file(day, 'previous_trips.csv')):
+            previous_trips = self._read_trips(day, 'previous_trips.csv')
+        else:
+            previous_trips = self._read_last_trips(day)
+            self._write_trips(day, 'previous_trips.csv', previous_trips)
+        last_trips = pd.concat([previous_trips, trips]).sort_values(by='starttime', kind='stable')
+        self._write_last_trips(last_trips.groupby('bikeid').tail(1))
+
+    def rebalancing(self, day):
+        """
+        Adds the rebalancing trips implied by the given day's trips, and assigns them ids.
+
+        A rebalancing trip belongs to the day of the trip which follows it, so the gap between a bike's last trip
+        before this day and its first trip of this day is detected here, and detected only once.
+        """
+        trips = self._read_trips(day, 'trips.csv')
+        previous_trips = self._read_trips(day, 'previous_trips.csv')
+        rebalancing_trips = detect_rebalancing_trips(pd.concat([previous_trips, trips]))
+        rebalancing_trips.index = self.checkpoints.reserve_trip_ids(len(rebalancing_trips))
+        self._write_trips(day, 'all_trips.csv', pd.concat([trips, rebalancing_trips]))
+
+    def geocoding(self, day):
+        """
+        Geocodes the trip geometries for the given day which are not already in the data store.
+
+        Bike trip geometries go straight into the data store, where they are shared with every other day. Rebalancing
+        trip geometries and time estimates are stored inline with their trip, so they are kept in the partition
+        until the insert stage. Trips which cannot be geocoded are recorded as failed and left out of the data store.
+        """
+        trips = self._read_trips(day, 'all_trips.csv')
+        progress = self._read_geocoding_progress(day)
+        failed_pairs = {tuple(pair) for pair in progress['failed pairs']}
+        is_rebalancing = (trips['usertype'] == 'Rebalancing').values
+        # One representative trip for every bike trip geometry still needed, in either orientation.
+        regular = trips[~is_rebalancing].drop_duplicates(subset=['start station id', 'end station id'])
+        stored = self.db.get_stored_geometry_pairs(zip(regular['start station id'].astype(float),
+                                                       regular['end station id'].astype(float)))
+        pending = dict()
+        for tripid, sid, eid in zip(regular.index, regular['start station id'].astype(float),
+                                    regular['end station id'].astype(float)):
+            if (sid, eid) not in stored and (sid, eid) not in failed_pairs and (eid, sid) not in pending:
+                pending[(sid, eid)] = tripid
+        rebalancing = [tripid for tripid in trips.index[is_rebalancing]
+                       if str(tripid) not in progress['rebalancing'] and tripid not in progress['failed trips']]
+        try:
+            for (sid, eid), tripid in pending.items():
+                if self.remaining_queries <= 0:
+                    return False
+                self.remaining_queries -= 1
+                trip = trips.loc[tripid]
+                try:
+                    coords = citibike_trips.BikeTrip.get_bike_trip_path(
+                        [trip['start station latitude'], trip['start station longitude']],
+                        [trip['end station latitude'], trip['end station longitude']], self.client)
+                # Sometimes a trip with impossible coordinates is passed---e.g. it appears that a few CitiBikes take a
+                # ferry ride between Governer's Island and mainland Manhattan.
+                except Exception:
+                    progress['failed pairs'].append([sid, eid])
+                    continue
+                self.db.insert_geometry(sid, eid, coords)
+            for tripid in rebalancing:
+                if self.remaining_queries <= 0:
+                    return False
+                self.remaining_queries -= 1
+                trip = trips.loc[tripid]
+                try:
+                    coords, time_estimate_mins = \
+                        citibike_trips.RebalancingTrip.get_rebalancing_trip_path_time_estimate_tuple(
+                            [trip['start station latitude'], trip['start station longitude']],
+                            [trip['end station latitude'], trip['end station longitude']], self.client)
+                except Exception:
+                    progress['failed trips'].append(int(tripid))
+                    continue
+                # Center the van trip in the gap between the two surrounding bike trips, as RebalancingTrip does.
+                midpoint_time = trip['starttime'] + ((trip['stoptime'] - trip['starttime']) / 2)
+                starttime = max(midpoint_time - timedelta(minutes=time_estimate_mins / 2), trip['starttime'])
+                stoptime = min(midpoint_time + timedelta(minutes=time_estimate_mins / 2), trip['stoptime'])
+                progress['rebalancing'][str(tripid)] = {
+                    'coordinates': coords,
+                    'tripduration': int(time_estimate_mins * 60),
+                    # The midpoint can fall on a half second; store whole seconds in one format, as the dataset does.
+                    'starttime': starttime.strftime("%Y-%m-%d %H:%M:%S"),
+                    'stoptime': stoptime.strftime("%Y-%m-%d %H:%M:%S")
+                }
+        finally:
+            self._write_geocoding_progress(day, progress)
+
+    def insert(self, day):
+        """
+        Writes the given day's trips into the data store, one chunk at a time.
+        """
+        trips = self._read_insertable_trips(day)
+        progress = self._read_geocoding_progress(day)
+        offset = self.checkpoints.get(day.isoformat(), 'insert offset', 0)
+        for start in range(offset, len(trips), self.chunksize):
+            chunk = trips.iloc[start:start + self.chunksize]
+            # A job killed after writing a chunk but before checkpointing it must not write that chunk twice.
+            chunk = chunk[~chunk.index.isin(self.db.get_stored_trip_ids(chunk.index.tolist()))]
+            batch = citibike_trips.TripBatch(chunk, self.client)
+            for position in np.flatnonzero(batch.rebalancing):
+                batch.geometries[position] = progress['rebalancing'][str(batch.ids[position])]['coordinates']
+            self.db.insert_trips(batch)
+            self.checkpoints.mark(day.isoformat(), 'insert offset', min(start + self.chunksize, len(trips)))
+
+    def indices(self, day):
+        """
+        Merges the given day's trips into the indices of the stations that they touch.
+        """
+        self.db.update_station_indices(build_station_indices(self._read_insertable_trips(day)))
+
+    # UTILITY
+    def _raw_month(self, day):
+        """
+        Returns the raw trip data for the month of the given day. The last two months read are kept in memory, since
+        the first day of a month also needs the last day of the month before.
+        """
+        month = (day.year, day.month)
+        if month not in self._raw_data:
+            raw_data = citibike_trips.get_raw_trip_data(year=day.year, month=day.month)
+            raw_data['starttime'] = pd.to_datetime(raw_data['starttime'])
+            raw_data['stoptime'] = pd.to_datetime(raw_data['stoptime'])
+            self._raw_data[month] = raw_data
+            if len(self._raw_data) > 2:
+                del self._raw_data[next(iter(self._raw_data))]
+        return self._raw_data[month]
+
+    def _read_last_trips(self, day):
+        """
+        Returns the last trip of every bike before the given day. The first time the pipeline is run there is no table
+        of these yet, so it starts out from the trips of the day before.
+        """
+        filename = os.path.join(self.workdir, 'last_trips.csv')
+        if os.path.isfile(filename):
+            last_trips = pd.read_csv(filename, index_col=0, parse_dates=['starttime', 'stoptime'])
+            return last_trips[last_trips['starttime'].dt.date < day]
+        previous_day = day - timedelta(days=1)
+        raw_data = self._raw_month(previous_day)
+        previous_trips = raw_data[raw_data['starttime'].dt.date == previous_day]
+        return previous_trips.sort_values(by='starttime').groupby('bikeid').tail(1)
+
+    def _write_last_trips(self, last_trips):
+        # Write and then rename, as the checkpoints are.
+        filename = os.path.join(self.workdir, 'last_trips.csv')
+        last_trips.to_csv(filename + '.tmp')
+        os.replace(filename + '.tmp', filename)
+
+    def _partition_file(self, day, name):
+        partition = os.path.join(self.workdir, day.isoformat())
+        os.makedirs(partition, exist_ok=True)
+        return os.path.join(partition, name)
+
+    def _read_trips(self, day, name):
+        return pd.read_csv(self._partition_file(day, name), index_col=0, parse_dates=['starttime', 'stoptime'])
+
+    def _write_trips(self, day, name, trips):
+        trips.to_csv(self._partition_file(day, name))
+
+    def _read_geocoding_progress(self, day):
+        filename = self._partition_file(day, 'geocoding.json')
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                return json.load(f)
+        else:
+            return {'rebalancing': {}, 'failed pairs': [], 'failed trips': []}
+
+    def _write_geocoding_progress(self, day, progress):
+        filename = self._partition_file(day, 'geocoding.json')
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(progress, f)
+        os.replace(filename + '.tmp', filename)
+
+    def _read_insertable_trips(self, day):
+        """
+        Returns the given day's trips, less the ones which could not be geocoded, with rebalancing trip time estimates
+        filled in.
+        """
+        trips = self._read_trips(day, 'all_trips.csv')
+        progress = self._read_geocoding_progress(day)
+        failed_pairs = {tuple(pair) for pair in progress['failed pairs']}
+        failed_pairs |= {pair[::-1] for pair in failed_pairs}
+        pairs = zip(trips['start station id'].astype(float), trips['end station id'].astype(float))
+        is_rebalancing = (trips['usertype'] == 'Rebalancing').values
+        failed = np.array([not rebalancing and pair in failed_pairs for rebalancing, pair in zip(is_rebalancing, pairs)],
+                          dtype=bool)
+        failed |= trips.index.isin(progress['failed trips'])
+        trips = trips[~failed]
+        estimates = pd.DataFrame.from_dict(progress['rebalancing'], orient='index',
+                                           columns=['tripduration', 'starttime', 'stoptime'])
+        if len(estimates) > 0:
+            estimates.index = estimates.index.astype(np.int64)
+            # Parse time by time: progress files written by earlier versions mix formats with and without fractional
+            # seconds, and pandas infers a single format from the first time.
+            estimates['starttime'] = pd.to_datetime(estimates['starttime'].map(pd.Timestamp))
+            estimates['stoptime'] = pd.to_datetime(estimates['stoptime'].map(pd.Timestamp))
+            trips.update(estimates)
+        return trips
+
+
+def main():
+    key = input("Enter a valid Google Direction API Key: ")
+    client = googlemaps.Client(key=key)
+    uri = input("Enter a valid MongoDB connection URI: ")
+    db = citibike_trips.DataStore(uri=uri)
+    start = datetime.strptime(input("Enter the first day to process (YYYY-MM-DD): "), "%Y-%m-%d").date()
+    end = datetime.strptime(input("Enter the last day to process (YYYY-MM-DD): "), "%Y-%m-%d").date()
+    n = input("How many trips do you want to geocode (daily API limit is 2500): ")
+    try:
+        if Pipeline(db, client, limit=int(n)).run(start, end):
+            print("No more data left to process!")
+        else:
+            print("Ran out of Google Directions API queries. Run again to resume.")
+    finally:
+        db.close()
+        print("Done.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Localization of the raw CitiBike trip data. See `citibike_trips`.
+"""
+
+import requests
+import zipfile
+import io
+import pandas as pd
+import numpy as np
+from datetime import datetime
+
+
+#########################
+# Raw Data Localization #
+#########################
+
+
+def get_raw_trip_data(month=None, year=None):
+    """
+    Downloads, unzips, and saves locally the CitiBike trips data for the given month.
+
+    The URIs used by CitiBike are of the form "https://s3.amazonaws.com/tripdata/201603-citibike-tripdata.zip". I
+    preserve this format locally---so 201603-citibike-tripdata.csv, 201412-citibike-tripdata.csv, and so on.
+
+    CitiBike goes back only to July 2013 (as of writing---though this is unlikely to change), so it is expected that
+    user input refer to a month there or after. Additionally note that it takes up to a month for the most recent
+    month's data to be uploaded, so reliably getting for example "last week's" data is out of the question.
+
+    This method checks whether or not the file is already available locally. It avoids re-downloading if it is.
+
+    Data is stored is a subdirectory: "data/201503.csv", for example.
+
+    Parameters
+    ----------
+    month: int
+        The month whose data is being localized, in integer format.
+
+    year: int
+        The year whose data is being localized, in integer format.
+    """
+    filename = '{0}{1}-citibike-tripdata'.format(year, str(month).zfill(2))
+    r = requests.get('https://s3.amazonaws.com/tripdata/{0}.zip'.format(filename))
+    with zipfile.ZipFile(io.BytesIO(r.content)) as ar:
+        trip_data = pd.read_csv(ar.open('{0}.csv'.format(filename)))
+        return trip_data
+
+
+def select_random_bike_week_from_2015_containing_n_plus_trips(n=25):
+    """
+    Selects and returns a random bike-week, starting on a Sunday, corresponding with a bike-week in at least the
+    50th percentile of bike-weeks overall.
+
+    The data that this method returns is a raw slice of the basic trip data, containing CSV-formatted trip starting
+    points and ending points, missing in-between re-balancing trips. To be use-able in our visualization there is
+    still so much work that must be done to get the selection into the desired GeoJSON shape.
+
+    Parameters
+    ----------
+    n: int
+        The number of trips that will be the minimum for the bike-weeks returned.
+
+    Returns
+    -------
+    A `pandas` DataFrame containing the raw selected bike-week data.
+    """
+    # Select a random week.
+    date_ranges = np.arange(np.datetime64('2015-01-04'),
+                            np.datetime64('2016-01-01'),
+                            step=np.timedelta64(1, 'W'))
+    start = np.random.choice(date_ranges)
+    end = start + np.timedelta64(1, 'W')
+    start_month = start.astype(datetime).month
+    end_month = end.astype(datetime).month
+    if start_month == end_month:
+        trip_data = get_raw_trip_data(year=2015, month=start_month)
+    else:
+        trip_data = pd.concat([get_raw_trip_data(year=2015, month=start_month),
+                               get_raw_trip_data(year=2015, month=end_month)])
+    # This conversion is very slow.
+    # print("Converting strings to datetimes...")
+    if isinstance(trip_data['starttime'][0], str):
+        trip_data['starttime'] = pd.to_datetime(trip_data['starttime'], infer_datetime_format=True)
+    if isinstance(trip_data['stoptime'][0], str):
+        trip_data['stoptime'] = pd.to_datetime(trip_data['stoptime'], infer_datetime_format=True)
+    # Extract that week from the monthly data.
+    selected_week = trip_data[(trip_data['starttime'] > start) & (trip_data['stoptime'] < end)]
+    # Pick a bike with more than 25 trips and return it.
+    value_counts = selected_week['bikeid'].value_counts()
+    selectable_bike_ids = value_counts[value_counts > n].index
+    chosen_bike_id = np.random.choice(selectable_bike_ids)
+    return selected_week[(selected_week['bikeid'] == chosen_bike_id)]
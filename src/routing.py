@@ -0,0 +1,45 @@
+"""
+The Google Directions API client used for trip geometry generation. See `citibike_trips`.
+"""
+
+import os
+import json
+import googlemaps
+
+
+#####################
+# Google API Client #
+#####################
+
+# This is a top-level resource because many different classes need it.
+
+
+def initialize_google_client(filename='google_maps_api_key.json'):
+    """
+    Imports the Google Directions API credentials used for polyline generation, returning a usable client.
+
+    You need to have your Google Maps API credentials stored locally as `google_maps_api_key.json` (or whatever
+    alternative filename you choose) using the following format for the next few lines to work:
+
+    { "key": "..." }
+
+    See the Google Developer Console (https://console.developers.google.com/) for information getting your own API
+    key. Note that you will need a *browser key*, specifically, not the similar but functionally different *server
+    key*.
+
+    Parameters
+    ----------
+    filename: str
+        The file the credentials are stored in.
+
+    Returns
+    -------
+    A googlemaps.Client with credentials initialized and ready for action.
+    """
+    if os.path.isfile(filename):
+        with open(filename) as f:
+            data = json.load(f)['key']
+        return googlemaps.Client(key=data)
+    else:
+        raise IOError(
+            'This API requires a Google Maps credentials token to work. Did you forget to define one?')
@@ -0,0 +1,157 @@
+"""
+In-memory spatial indices over stations and trip geometries, which back the viewport queries of `DataStore`.
+
+Both are built on a uniform grid: every bounding box is filed under each of the grid cells that it overlaps, and a
+query only has to look at the items filed under the cells that it overlaps. For city-scale data this is about as fast
+as a KD-tree or an R-tree, and it is a lot simpler to build from numpy arrays.
+
+Bounding boxes are of the form (min latitude, min longitude, max latitude, max longitude), matching the
+[latitude, longitude] order of the coordinates stored in the data store.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class BoundingBoxIndex:
+    """
+    Class encoding a uniform grid index over a set of bounding boxes. Points are boxes with no extent.
+    """
+    def __init__(self, boxes, cell_size=0.01):
+        """
+        Parameters
+        ----------
+        boxes: np.ndarray
+            An (n, 4) array of bounding boxes.
+        cell_size: float
+            The size of the grid cells, in degrees. The default is roughly a kilometer.
+        """
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.cell_size = cell_size
+        low = np.floor(self.boxes[:, :2] / cell_size).astype(np.int64)
+        high = np.floor(self.boxes[:, 2:] / cell_size).astype(np.int64)
+        # File every box under every cell it overlaps, as a list of (cell key, box) entries sorted by cell key.
+        shape = high - low + 1
+        counts = shape[:, 0] * shape[:, 1]
+        items = np.repeat(np.arange(len(self.boxes)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        keys = self._key(low[items, 0] + offsets // shape[items, 1], low[items, 1] + offsets % shape[items, 1])
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.items = items[order]
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @staticmethod
+    def _key(rows, columns):
+        return (rows + 2 ** 24) * 2 ** 26 + (columns + 2 ** 24)
+
+    def query(self, bbox):
+        """
+        Returns the sorted positions of the boxes which intersect the given bounding box.
+        """
+        min_lat, min_lon, max_lat, max_lon = bbox
+        rows = np.arange(np.floor(min_lat / self.cell_size), np.floor(max_lat / self.cell_size) + 1, dtype=np.int64)
+        columns = np.arange(np.floor(min_lon / self.cell_size), np.floor(max_lon / self.cell_size) + 1,
+                            dtype=np.int64)
+        if len(rows) * len(columns) > len(self.keys):
+            # The query covers more cells than there are entries; looking at every box is cheaper.
+            candidates = np.arange(len(self.boxes))
+        else:
+            keys = self._key(np.repeat(rows, len(columns)), np.tile(columns, len(rows)))
+            starts = np.searchsorted(self.keys, keys, side='left')
+            counts = np.searchsorted(self.keys, keys, side='right') - starts
+            entries = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            candidates = np.unique(self.items[entries])
+        boxes = self.boxes[candidates]
+        hits = (boxes[:, 0] <= max_lat) & (boxes[:, 2] >= min_lat) & \
+               (boxes[:, 1] <= max_lon) & (boxes[:, 3] >= min_lon)
+        return candidates[hits]
+
+
+class StationIndex:
+    """
+    Class encoding a spatial index over station locations.
+    """
+    def __init__(self, station_ids, latitudes, longitudes, cell_size=0.01):
+        self.station_ids = np.asarray(station_ids)
+        self.points = np.column_stack([latitudes, longitudes]).astype(np.float64)
+        self.index = BoundingBoxIndex(np.hstack([self.points, self.points]), cell_size=cell_size)
+        # Longitude is scaled down when measuring distances, so that a degree means about the same either way.
+        self.scale = np.cos(np.radians(self.points[:, 0].mean())) if len(self.points) else 1
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    @classmethod
+    def from_metadata(cls, filename="../data/final/june_22_station_metadata.csv"):
+        """
+        Builds a StationIndex out of a station metadata file, e.g. `june_22_station_metadata.csv`.
+        """
+        stations = pd.read_csv(filename, index_col=0)
+        return cls(stations.index.values, stations['latitude'].values, stations['longitude'].values)
+
+    def within(self, bbox):
+        """
+        Returns the ids of the stations inside of the given bounding box.
+        """
+        return self.station_ids[self.index.query(bbox)].tolist()
+
+    def nearest(self, latitude, longitude, k=1):
+        """
+        Returns the ids of the k stations nearest to the given point, nearest first.
+        """
+        k = min(k, len(self))
+        radius = self.index.cell_size
+        while True:
+            candidates = self.index.query((latitude - radius, longitude - radius / self.scale,
+                                           latitude + radius, longitude + radius / self.scale))
+            offsets = (self.points[candidates] - [latitude, longitude]) * [1, self.scale]
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+            # Every station within the search radius is a candidate, so once k of them are, they are the nearest k.
+            if (distances <= radius).sum() >= k or len(candidates) == len(self):
+                return self.station_ids[candidates[np.argsort(distances, kind='stable')[:k]]].tolist()
+            radius *= 2
+
+
+class GeometryIndex:
+    """
+    Class encoding a spatial index over the bounding boxes of the trip geometries in the "trip-geometries" store.
+    """
+    def __init__(self, pairs, boxes, cell_size=0.01):
+        """
+        Parameters
+        ----------
+        pairs: list
+            The (start station id, end station id) pair of each geometry.
+        boxes: np.ndarray
+            The (n, 4) array of the bounding boxes of the geometries.
+        """
+        self.pairs = list(pairs)
+        self.index = BoundingBoxIndex(boxes, cell_size=cell_size)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    @classmethod
+    def from_geometries(cls, geometries):
+        """
+        Builds a GeometryIndex out of an iterable of documents from the "trip-geometries" store.
+        """
+        pairs = []
+        boxes = []
+        for geom in geometries:
+            coordinates = np.asarray(geom['coordinates'], dtype=np.float64).reshape(-1, 2)
+            if len(coordinates) == 0:
+                continue
+            pairs.append((geom['start station id'], geom['end station id']))
+            boxes.append(np.concatenate([coordinates.min(axis=0), coordinates.max(axis=0)]))
+        return cls(pairs, np.array(boxes).reshape(-1, 4))
+
+    def intersecting(self, bbox):
+        """
+        Returns the (start station id, end station id) pairs of the geometries whose bounding boxes intersect the
+        given bounding box.
+        """
+        return [self.pairs[i] for i in self.index.query(bbox)]
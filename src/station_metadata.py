@@ -0,0 +1,135 @@
+"""
+Builds the station metadata table (see the data dictionary in the README) from a frame of trips, replacing the
+per-station and per-bike loops of notebooks 07 through 09 with a handful of group-by passes.
+
+Metadata can be computed for the trips as a whole or broken down by day or by hour, and tables computed for different
+days can be merged, so new days of data can be folded into existing metadata without recomputing the old ones.
+
+Incoming trips are those which end at a station and outgoing trips those which start there, as in the data dictionary.
+Notebook 07 originally had these the other way around; tables written by it before that was fixed have to be converted
+with `convert_notebook_metadata` before they can be merged with new ones. The copy of `june_22_station_metadata.csv`
+in this repository already has been.
+
+Run as a script this writes the metadata for a trips file, optionally merged into an existing metadata file.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+count_columns = ['incoming trips', 'outgoing trips', 'bikes outbound', 'outbound trips', 'bikes inbound',
+                 'inbound trips']
+columns = ['latitude', 'longitude', 'station name', 'incoming trips', 'outgoing trips', 'all trips', 'kind',
+           'bikes outbound', 'outbound trips', 'bikes inbound', 'inbound trips', 'delta bikes', 'delta trips']
+
+
+def compute_station_metadata(trips, freq=None):
+    """
+    Computes the station metadata table for a set of trips.
+
+    A bike's day starts at the start station of its first trip and ends at the end station of its last. When the
+    metadata is broken down by period, "day" means that period instead.
+
+    Parameters
+    ----------
+    trips: pd.DataFrame
+        Trips in the format of `all_june_22_citibike_trips.csv`.
+    freq: str
+        If given, the metadata is broken down into periods of this frequency by trip start time, e.g. 'D' for per-day
+        or 'h' for per-hour metadata. Otherwise it covers all of the trips at once.
+
+    Returns
+    -------
+    A `pandas` DataFrame in the format of `june_22_station_metadata.csv`, indexed by station id, or by period and
+    station id if a frequency was given.
+    """
+    trips = trips.assign(starttime=pd.to_datetime(trips['starttime']),
+                         **{'start station id': trips['start station id'].astype(int),
+                            'end station id': trips['end station id'].astype(int)})
+    keys = []
+    if freq is not None:
+        trips = trips.assign(period=trips['starttime'].dt.floor(freq))
+        keys = ['period']
+    locations = _station_locations(trips)
+    incoming = trips.groupby(keys + ['end station id']).size()
+    outgoing = trips.groupby(keys + ['start station id']).size()
+    # Collapse trips down to bikes, recording where each bike starts and ends its day and how many trips it takes.
+    bikes = trips.sort_values(by='starttime').groupby(keys + ['bikeid']).agg(
+        first_station=('start station id', 'first'),
+        last_station=('end station id', 'last'),
+        trips=('starttime', 'size')
+    )
+    outbound = bikes.groupby(keys + ['first_station'])['trips'].agg(['size', 'sum'])
+    inbound = bikes.groupby(keys + ['last_station'])['trips'].agg(['size', 'sum'])
+    metadata = pd.concat([incoming.rename_axis(keys + ['station id']).rename('incoming trips'),
+                          outgoing.rename_axis(keys + ['station id']).rename('outgoing trips'),
+                          outbound['size'].rename_axis(keys + ['station id']).rename('bikes outbound'),
+                          outbound['sum'].rename_axis(keys + ['station id']).rename('outbound trips'),
+                          inbound['size'].rename_axis(keys + ['station id']).rename('bikes inbound'),
+                          inbound['sum'].rename_axis(keys + ['station id']).rename('inbound trips')], axis='columns')
+    metadata = metadata.fillna(0).astype(int)
+    metadata = metadata.join(locations, on='station id')
+    return _finalize(metadata)
+
+
+def merge_station_metadata(*tables):
+    """
+    Merges station metadata tables computed for disjoint sets of trips, e.g. for two different days, into one.
+
+    Counts are summed, so for example "bikes outbound" in the merged table counts bike-days. Tables broken down by
+    period are merged period by period.
+    """
+    metadata = pd.concat(tables)
+    levels = list(range(metadata.index.nlevels))
+    grouped = metadata.groupby(level=levels)
+    merged = grouped[count_columns].sum().join(grouped[['latitude', 'longitude', 'station name']].first())
+    return _finalize(merged)
+
+
+def convert_notebook_metadata(metadata):
+    """
+    Converts a station metadata table written by notebook 07 before its incoming and outgoing trip counts were fixed,
+    by swapping the two. See the module docstring.
+    """
+    return metadata.rename(columns={'incoming trips': 'outgoing trips', 'outgoing trips': 'incoming trips'})[columns]
+
+
+def _station_locations(trips):
+    """
+    Returns the latitude, longitude, and name of every station which appears in a set of trips.
+    """
+    ends = {'latitude': 'latitude', 'longitude': 'longitude', 'name': 'station name', 'id': 'station id'}
+    locations = pd.concat([trips[['{0} station {1}'.format(end, field) for field in ends]]
+                           .set_axis(list(ends.values()), axis='columns') for end in ['start', 'end']])
+    return locations.drop_duplicates(subset='station id').set_index('station id')
+
+
+def _finalize(metadata):
+    """
+    Fills in the columns of a station metadata table which are derived from the others, and orders them.
+    """
+    metadata['all trips'] = metadata['incoming trips'] + metadata['outgoing trips']
+    metadata['delta bikes'] = metadata['bikes inbound'] - metadata['bikes outbound']
+    metadata['delta trips'] = metadata['inbound trips'] - metadata['outbound trips']
+    # Station kind, as in notebook 07: depots, stations out for maintenance, and active stations.
+    metadata['kind'] = np.where(metadata['station name'].str.contains('Depot', case=False, na=False), 'depot',
+                                np.where(metadata['all trips'] == 0, 'inactive', 'active'))
+    return metadata[columns].sort_index()
+
+
+def main():
+    trips_file = input("Enter the trips file to compute station metadata for: ")
+    existing = input("Enter an existing station metadata file to merge into (or leave blank): ")
+    f = input("Where do you want to store this: ")
+    metadata = compute_station_metadata(pd.read_csv(trips_file, index_col=0))
+    if existing:
+        existing_metadata = pd.read_csv(existing, index_col=0)
+        if input("Was the existing file written by an older copy of notebook 07, which counted incoming trips by start "
+                 "station? (y/n): ").strip().lower() == 'y':
+            existing_metadata = convert_notebook_metadata(existing_metadata)
+        metadata = merge_station_metadata(existing_metadata, metadata)
+    metadata.to_csv(f)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,149 @@ Unittest module.
 
 import unittest
 
+import os
+import gzip
+import tempfile
+import numpy as np
 import pandas as pd
 import pymongo
 import citibike_trips
+import pipeline
+import animation_frames
+import station_metadata
+import spatial
+import import_time_benchmark
+import exporter
+import integrity_verifier
+import json
+from collections import defaultdict
 from datetime import datetime
 
 
+# SHARED FIXTURES
+def make_trip(tripid=0, bikeid=17609.0, usertype='Subscriber', start=1, end=2, startepoch=1466582400,
+              stopepoch=1466583000, coordinates=None, _id=None):
+    """
+    Returns a trip in the format stored in the "citibike-trips" store. Pass startepoch=None for a trip written before
+    the epoch times existed, and an _id for one fresh out of the database.
+    """
+    properties = {'tripid': tripid, 'bikeid': bikeid, 'usertype': usertype,
+                  'start station id': start, 'start station latitude': 40.7, 'start station longitude': -74.0,
+                  'end station id': end, 'end station latitude': 40.8, 'end station longitude': -73.9,
+                  'starttime': '6/22/2016 08:00:00', 'stoptime': '6/22/2016 08:10:00'}
+    if startepoch is not None:
+        properties.update(startepoch=startepoch, stopepoch=stopepoch)
+    trip = {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': list(coordinates or [])},
+            'properties': properties}
+    if _id is not None:
+        trip['_id'] = _id
+    return trip
+
+
+def make_raw_trip(bikeid, start, end, starttime, stoptime):
+    """
+    Returns a row of raw trip data, as returned by `citibike_trips.get_raw_trip_data`.
+    """
+    return {'tripduration': 0, 'starttime': pd.Timestamp(starttime), 'stoptime': pd.Timestamp(stoptime),
+            'start station id': start, 'start station name': str(start), 'start station latitude': 40.7,
+            'start station longitude': -74.0, 'end station id': end, 'end station name': str(end),
+            'end station latitude': 40.8, 'end station longitude': -73.9, 'bikeid': bikeid,
+            'usertype': 'Subscriber', 'birth year': 1985, 'gender': 1}
+
+
+def make_directory(test):
+    """
+    Returns a temporary directory which is removed once the given test is done.
+    """
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    return directory.name
+
+
+class FakeCursor(list):
+    """
+    A stand-in for a pymongo cursor over a list of documents.
+    """
+    def sort(self, *args, **kwargs):
+        return self
+
+    def skip(self, n):
+        return self
+
+    def limit(self, n):
+        return self
+
+    def next(self):
+        return next(iter(self))
+
+
+class FakeCollection:
+    """
+    A stand-in for a pymongo collection, which records the queries made of it and the documents inserted into it, as
+    well as its bulk writes and deletions. Queries return every document, except for `find_one`, which matches on
+    top-level fields.
+    """
+    def __init__(self, documents=()):
+        self.documents = [dict(document) for document in documents]
+        self.queries = []
+        self.inserts = []
+        self.writes = []
+        self.deletes = []
+
+    def find(self, query=None, *args, **kwargs):
+        self.queries.append(query)
+        return FakeCursor(dict(document) for document in self.documents)
+
+    def find_one(self, query=None, *args, **kwargs):
+        self.queries.append(query)
+        matches = [document for document in self.documents
+                   if all(document.get(key) == value for key, value in (query or dict()).items())]
+        return dict(matches[0]) if matches else None
+
+    def insert_many(self, documents):
+        self.inserts.append([dict(document) for document in documents])
+        self.documents += self.inserts[-1]
+
+    def bulk_write(self, requests, ordered=True):
+        self.writes += requests
+
+    def delete_many(self, query):
+        self.deletes.append(query)
+        return pymongo.results.DeleteResult({'n': 0}, acknowledged=True)
+
+    def delete_one(self, query):
+        self.deletes.append(query)
+        return pymongo.results.DeleteResult({'n': 0}, acknowledged=True)
+
+
+def fake_datastore(**collections):
+    """
+    Returns a DataStore which is not connected to a database, backed by FakeCollections. Collections are given by
+    name, with the dashes replaced by underscores; any others are created empty on first use.
+    """
+    db = citibike_trips.DataStore.__new__(citibike_trips.DataStore)
+    stores = {name.replace('_', '-'): collection for name, collection in collections.items()}
+    db.client = {'citibike': defaultdict(FakeCollection, stores)}
+    db.max_trip_duration = None
+    db.station_index = None
+    db.geometry_index = None
+    return db
+
+
+class FakeDataStore:
+    """
+    A stand-in for the parts of DataStore that the exporter and the pipeline read from, serving fixed batches of trips.
+    """
+    def __init__(self, batches=()):
+        self.batches = list(batches)
+
+    def iter_trip_batches(self, batch_size=1000, **filters):
+        return iter(self.batches)
+
+    def get_max_trip_id(self):
+        return max((trip['properties']['tripid'] for batch in self.batches for trip in batch), default=-1)
+
+
 class DataLocalizationTest(unittest.TestCase):
 
     def testMonthlyDataLocalization(self):
@@ -84,6 +221,424 @@ class RebalancingTest(unittest.TestCase):
         self.assertTrue(len(rebalancing_trip.data['geometry']['coordinates']) > 0)
 
 
+class TripBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        # Geometry is lazily loaded, so no Google Maps client is needed to test properties.
+        self.raw_trips = pd.read_csv("../data/part_1/sample_trips.csv", index_col=0)
+        self.batch = citibike_trips.TripBatch(self.raw_trips, None)
+
+    def testInitialization(self):
+        self.assertEqual(len(self.batch), len(self.raw_trips))
+        self.assertEqual(self.batch.properties['bikeid'].dtype, 'float64')
+
+    def testView(self):
+        trip = self.batch[0]
+        self.assertEqual(trip.id, int(self.raw_trips.index[0]))
+        self.assertEqual(trip['start station id'], 151.0)
+        self.assertTrue(isinstance(trip['bikeid'], float))
+        self.assertRaises(AttributeError, setattr, trip, 'data_cache', None)
+
+    def testDocuments(self):
+        documents = self.batch.to_documents()
+        self.assertEqual(len(documents), len(self.raw_trips))
+        props = documents[0]['properties']
+        self.assertEqual(props['tripid'], int(self.raw_trips.index[0]))
+        self.assertTrue(all(type(props[p]) is float for p in citibike_trips.TripBatch.numeric_properties))
+        self.assertEqual(documents[0]['geometry']['coordinates'], [])
+
+    def testEpochs(self):
+        props = self.batch.to_documents([0])[0]['properties']
+        self.assertEqual(props['startepoch'], citibike_trips.to_epoch(props['starttime']))
+        self.assertTrue(props['startepoch'] <= props['stopepoch'])
+        self.assertEqual(citibike_trips.to_epoch("6/22/2016 8:02:58"),
+                         citibike_trips.to_epoch(datetime(2016, 6, 22, 8, 2, 58)))
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trips = pd.read_csv("../data/part_1/sample_trips.csv", index_col=0, parse_dates=['starttime', 'stoptime'])
+
+    def testRebalancingDetection(self):
+        rebalancing_trips = pipeline.detect_rebalancing_trips(self.trips)
+        self.assertTrue(len(rebalancing_trips) > 0)
+        self.assertTrue((rebalancing_trips['usertype'] == 'Rebalancing').all())
+        self.assertTrue((rebalancing_trips['start station id'] != rebalancing_trips['end station id']).all())
+        self.assertTrue((rebalancing_trips['starttime'] <= rebalancing_trips['stoptime']).all())
+
+    def testMidnightPartitions(self):
+        raw_data = pd.DataFrame([make_raw_trip(1, 1, 2, "2016-06-21 23:50", "2016-06-22 00:10"),
+                                 make_raw_trip(1, 3, 4, "2016-06-22 08:00", "2016-06-22 08:20")])
+        runner = pipeline.Pipeline(FakeDataStore(), None, workdir=make_directory(self))
+        runner._raw_data = {(2016, 6): raw_data}
+        for day in [datetime(2016, 6, 21).date(), datetime(2016, 6, 22).date()]:
+            runner.load(day)
+            runner.rebalancing(day)
+        first_day = runner._read_trips(datetime(2016, 6, 21).date(), 'all_trips.csv')
+        second_day = runner._read_trips(datetime(2016, 6, 22).date(), 'all_trips.csv')
+        # The trip across midnight belongs to the day it started on, and the overnight move to the day after.
+        self.assertEqual(first_day['start station id'].tolist(), [1])
+        self.assertEqual(second_day['usertype'].tolist(), ['Subscriber', 'Rebalancing'])
+        self.assertEqual(second_day['start station id'].tolist(), [3, 2])
+
+    def testIdleBikes(self):
+        # Bike 1 is idle on the 22nd and turns up somewhere else on the 23rd; bike 2 rides every day.
+        raw_data = pd.DataFrame([make_raw_trip(1, 1, 2, "2016-06-21 09:00", "2016-06-21 09:20"),
+                                 make_raw_trip(2, 5, 6, "2016-06-21 10:00", "2016-06-21 10:20"),
+                                 make_raw_trip(2, 6, 5, "2016-06-22 10:00", "2016-06-22 10:20"),
+                                 make_raw_trip(1, 3, 4, "2016-06-23 08:00", "2016-06-23 08:20"),
+                                 make_raw_trip(2, 5, 6, "2016-06-23 10:00", "2016-06-23 10:20")])
+        runner = pipeline.Pipeline(FakeDataStore(), None, workdir=make_directory(self))
+        runner._raw_data = {(2016, 6): raw_data}
+        days = [datetime(2016, 6, 21).date(), datetime(2016, 6, 22).date(), datetime(2016, 6, 23).date()]
+        for day in days:
+            runner.load(day)
+            runner.rebalancing(day)
+        # Loading a day over again, as a resumed job might, does not detect its rebalancing trips twice.
+        runner.load(days[-1])
+        runner.rebalancing(days[-1])
+        rebalancing = pd.concat([runner._read_trips(day, 'all_trips.csv') for day in days])
+        rebalancing = rebalancing[rebalancing['usertype'] == 'Rebalancing']
+        self.assertEqual(rebalancing[['bikeid', 'start station id', 'end station id']].values.tolist(), [[1, 2, 3]])
+
+    def testMixedTimeFormats(self):
+        raw_data = pd.DataFrame([make_raw_trip(1, 1, 2, "2016-03-08 00:10", "2016-03-08 00:20"),
+                                 make_raw_trip(1, 3, 4, "2016-03-08 05:00", "2016-03-08 05:20"),
+                                 make_raw_trip(2, 1, 2, "2016-03-08 01:00", "2016-03-08 01:10"),
+                                 make_raw_trip(2, 3, 4, "2016-03-08 04:00:01", "2016-03-08 04:10")])
+        runner = pipeline.Pipeline(FakeDataStore(), None, workdir=make_directory(self))
+        runner._raw_data = {(2016, 3): raw_data}
+        day = datetime(2016, 3, 8).date()
+        runner.load(day)
+        runner.rebalancing(day)
+        trips = runner._read_trips(day, 'all_trips.csv')
+        rebalancing = trips.index[trips['usertype'] == 'Rebalancing']
+        # One time estimate in whole seconds and one in half seconds, as written by earlier versions.
+        runner._write_geocoding_progress(day, {'rebalancing': {
+            str(rebalancing[0]): {'coordinates': [], 'tripduration': 600, 'starttime': '2016-03-08T02:30:00',
+                                  'stoptime': '2016-03-08T02:40:00'},
+            str(rebalancing[1]): {'coordinates': [], 'tripduration': 600, 'starttime': '2016-03-08T02:30:00.500000',
+                                  'stoptime': '2016-03-08T02:40:00.500000'}
+        }, 'failed pairs': [], 'failed trips': []})
+        trips = runner._read_insertable_trips(day)
+        self.assertEqual(trips.loc[rebalancing, 'starttime'].tolist(),
+                         [pd.Timestamp('2016-03-08 02:30:00'), pd.Timestamp('2016-03-08 02:30:00.500000')])
+
+    def testStationIndices(self):
+        indices = pipeline.build_station_indices(self.trips)
+        outgoing = sum(len(tripsets.get('outgoing trip indices', [])) for tripsets in indices.values())
+        outbound = sum(len(tripsets.get('outbound bike trip indices', [])) for tripsets in indices.values())
+        self.assertEqual(outgoing, len(self.trips))
+        self.assertEqual(outbound, len(self.trips))
+
+
+class AnimationFramesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trips = [make_trip(bikeid=1, startepoch=100, stopepoch=200, coordinates=[[0, 0], [1, 0], [2, 0]]),
+                      make_trip(bikeid=1, startepoch=300, stopepoch=400, coordinates=[[5, 5], [6, 5]]),
+                      make_trip(bikeid=2, startepoch=0, stopepoch=50, coordinates=[[10, 10], [10, 11]])]
+        self.directory = make_directory(self)
+
+    def testInterpolation(self):
+        bike_ids, positions = animation_frames.interpolate_positions(self.trips, np.array([0, 150, 250, 350, 500]))
+        self.assertEqual(bike_ids.tolist(), [1, 2])
+        self.assertEqual(positions.dtype, np.float32)
+        self.assertEqual(positions[:, 0].tolist(), [[0, 0], [1, 0], [2, 0], [5.5, 5], [6, 5]])
+        self.assertEqual(positions[:, 1].tolist(), [[10, 10], [10, 11], [10, 11], [10, 11], [10, 11]])
+
+    def testFrames(self):
+        filename = os.path.join(self.directory, 'frames.npy')
+        frames = animation_frames.AnimationFrames.build(self.trips, filename, step=50)
+        self.assertEqual(frames[:].shape, (9, 2, 2))
+        self.assertEqual(frames.get_frames(150, 250).tolist(), frames[3:6].tolist())
+
+    def testChunks(self):
+        # Frames computed a few at a time match those computed all at once.
+        filename = os.path.join(self.directory, 'frames.npy')
+        frames = animation_frames.AnimationFrames.build(self.trips, filename, step=10, chunksize=7)
+        _, positions = animation_frames.interpolate_positions(self.trips, np.arange(0, 401, 10))
+        self.assertEqual(frames[:].tolist(), positions.tolist())
+
+    def testNoTrips(self):
+        filename = os.path.join(self.directory, 'frames.npy')
+        self.assertEqual(animation_frames.AnimationFrames.build([], filename)[:].shape, (0, 0, 2))
+        frames = animation_frames.AnimationFrames.build([], filename, start=0, stop=100, step=50)
+        self.assertEqual(frames[:].shape, (3, 0, 2))
+
+
+class StationMetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trips = pd.read_csv("../data/part_1/sample_trips.csv", index_col=0)
+
+    def testMetadata(self):
+        metadata = station_metadata.compute_station_metadata(self.trips)
+        self.assertEqual(list(metadata.columns), station_metadata.columns)
+        self.assertEqual(metadata['incoming trips'].sum(), len(self.trips))
+        self.assertEqual(metadata['outbound trips'].sum(), len(self.trips))
+        self.assertEqual(metadata['bikes outbound'].sum(), self.trips['bikeid'].nunique())
+        self.assertEqual(metadata['delta bikes'].sum(), 0)
+
+    def testMerge(self):
+        days = [trips for _, trips in self.trips.groupby(pd.to_datetime(self.trips['starttime']).dt.date)]
+        merged = station_metadata.merge_station_metadata(*[station_metadata.compute_station_metadata(trips)
+                                                           for trips in days])
+        by_day = station_metadata.compute_station_metadata(self.trips, freq='D')
+        self.assertTrue(merged.equals(station_metadata.merge_station_metadata(by_day.droplevel('period'))))
+        self.assertEqual(merged['all trips'].sum(), 2 * len(self.trips))
+
+    def testExistingMetadata(self):
+        existing = pd.read_csv("../data/final/june_22_station_metadata.csv", index_col=0)
+        self.assertTrue(station_metadata.merge_station_metadata(existing).equals(existing.sort_index()))
+
+    def testNotebookConversion(self):
+        metadata = station_metadata.compute_station_metadata(self.trips)
+        notebook = metadata.rename(columns={'incoming trips': 'outgoing trips', 'outgoing trips': 'incoming trips'})
+        self.assertTrue(station_metadata.convert_notebook_metadata(notebook[station_metadata.columns]).equals(metadata))
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stations = spatial.StationIndex.from_metadata("../data/final/june_22_station_metadata.csv")
+
+    def testBoundingBoxQuery(self):
+        boxes = np.array([[40.70, -74.00, 40.72, -73.98],
+                          [40.75, -73.99, 40.75, -73.99],
+                          [40.60, -74.10, 40.80, -73.90]])
+        index = spatial.BoundingBoxIndex(boxes)
+        self.assertEqual(index.query((40.71, -73.99, 40.74, -73.97)).tolist(), [0, 2])
+        self.assertEqual(index.query((40.745, -73.995, 40.755, -73.985)).tolist(), [1, 2])
+        self.assertEqual(index.query((41, -73, 42, -72)).tolist(), [])
+
+    def testNearestStations(self):
+        # W 52 St & 11 Ave, see `june_22_station_metadata.csv`.
+        self.assertEqual(self.stations.nearest(40.76727216, -73.99392888, k=1), [72])
+        self.assertEqual(len(self.stations.nearest(40.76727216, -73.99392888, k=5)), 5)
+
+    def testStationsWithin(self):
+        within = self.stations.within((40.76, -74.00, 40.77, -73.99))
+        self.assertTrue(72 in within)
+        self.assertTrue(all(40.76 <= lat <= 40.77 for lat in self.stations.points[np.isin(self.stations.station_ids,
+                                                                                                  within), 0]))
+
+
+class ImportTest(unittest.TestCase):
+
+    def testReadPathImports(self):
+        self.assertEqual(import_time_benchmark.loaded_heavy_modules(import_time_benchmark.read_path), [])
+
+    def testWindowQueryImports(self):
+        self.assertEqual(import_time_benchmark.loaded_heavy_modules(import_time_benchmark.window_path), [])
+
+    def testLazyNames(self):
+        for name in citibike_trips.__all__:
+            self.assertTrue(hasattr(citibike_trips, name))
+        self.assertRaises(AttributeError, getattr, citibike_trips, 'NotAThing')
+
+
+class ExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trips = [make_trip(tripid, coordinates=[[40.7, -74.0], [40.8, -73.9]]) for tripid in range(3)]
+
+    def testNDJSON(self):
+        lines = exporter.encode_ndjson(self.trips).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.trips)
+
+    def testGeoJSON(self):
+        features = b'[' + exporter.encode_geojson(self.trips) + b']'
+        self.assertEqual(json.loads(features.decode('utf-8')), self.trips)
+
+    def testColumns(self):
+        columns = exporter.encode_columns(self.trips)
+        self.assertEqual(columns['tripid'], [0, 1, 2])
+        self.assertEqual(len(columns['coordinates']), 3)
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        # The first batch has no geometry and no epoch times; the properties only show up in the batches after it.
+        self.batches = [[make_trip(0, startepoch=None), make_trip(1, startepoch=None)],
+                        [make_trip(2, coordinates=[[40.7, -74.0], [40.8, -73.9]])],
+                        [make_trip(3, coordinates=[[40.7, -74.0]]), make_trip(4)]]
+        self.db = FakeDataStore(self.batches)
+        self.directory = make_directory(self)
+
+    def testNDJSON(self):
+        filename = os.path.join(self.directory, 'trips.ndjson.gz')
+        self.assertEqual(exporter.export(self.db, filename, compression='gzip', workers=0), 5)
+        with gzip.open(filename, 'rt') as f:
+            trips = [json.loads(line) for line in f]
+        self.assertEqual(trips, [trip for batch in self.batches for trip in batch])
+
+    def testGeoJSON(self):
+        # Run through the process pool, which has to keep the batches in order.
+        for workers in [0, 2]:
+            filename = os.path.join(self.directory, 'trips.geojson')
+            exporter.export(self.db, filename, fmt='geojson', workers=workers)
+            with open(filename) as f:
+                collection = json.load(f)
+            self.assertEqual(collection['type'], 'FeatureCollection')
+            self.assertEqual([trip['properties']['tripid'] for trip in collection['features']], [0, 1, 2, 3, 4])
+
+    def testEmptyGeoJSON(self):
+        filename = os.path.join(self.directory, 'trips.geojson')
+        exporter.export(FakeDataStore(), filename, fmt='geojson', workers=0)
+        with open(filename) as f:
+            self.assertEqual(json.load(f)['features'], [])
+
+    def testParquet(self):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        filename = os.path.join(self.directory, 'trips.parquet')
+        exporter.export(self.db, filename, fmt='parquet', workers=2)
+        table = pyarrow.parquet.read_table(filename).to_pydict()
+        self.assertEqual(list(table), list(exporter.parquet_columns))
+        self.assertEqual(table['tripid'], [0, 1, 2, 3, 4])
+        self.assertEqual(table['startepoch'], [None, None, 1466582400, 1466582400, 1466582400])
+        self.assertEqual(table['coordinates'][2], [[40.7, -74.0], [40.8, -73.9]])
+
+
+class IntegrityVerifierTest(unittest.TestCase):
+
+    def testDrift(self):
+        unlisted, stale = integrity_verifier.find_drift([3, 1, 2], [2, 9, 1])
+        self.assertEqual(unlisted.tolist(), [3])
+        self.assertEqual(stale.tolist(), [9])
+
+    def testDangling(self):
+        indices = [{'station id': '72', 'tripsets': {'outgoing trip indices': [1, 10], 'incoming trip indices': [2]}},
+                   {'station id': '79', 'tripsets': {'outgoing trip indices': []}}]
+        dangling = integrity_verifier.find_dangling(indices, np.array([1, 2, 3]))
+        self.assertEqual(dangling, {'72': {'outgoing trip indices': [10]}})
+        self.assertEqual(integrity_verifier.find_dangling([], np.array([1])), dict())
+
+    def testGeometries(self):
+        missing, orphans = integrity_verifier.match_geometries([(1, 2), (2, 1), (3, 4)], [(2, 1), (7, 8)])
+        self.assertEqual(missing, [2])
+        self.assertEqual(orphans, [1])
+
+    def testIdListMigration(self):
+        ids = FakeCollection([{'name': 'id-list', 'id-list': [1, 2, 9]}])
+        db = fake_datastore(citibike_trip_ids=ids)
+        report = {'dangling tripset ids': {}, 'orphan geometries': [], 'unlisted trip ids': [3], 'stale trip ids': [9],
+                  'legacy id list': True, 'missing geometries': []}
+        repaired, _, _ = integrity_verifier.repair(db, report)
+        self.assertEqual(repaired['trip id list'], 2)
+        # The listed ids get a document apiece, the stale one is dropped, and so is the single-document list.
+        self.assertEqual(len(ids.writes), 3)
+        self.assertTrue(all(pymongo.UpdateOne({'tripid': tripid}, {'$setOnInsert': {'tripid': tripid}}, upsert=True)
+                            in ids.writes for tripid in (1, 2, 3)))
+        self.assertEqual(ids.deletes, [{'tripid': {'$in': [9]}}, {'name': 'id-list'}])
+
+    def testOrphanDeletion(self):
+        # Orphan geometries may be waiting on an unfinished pipeline run, so they are only deleted when asked to be.
+        geometries = FakeCollection()
+        db = fake_datastore(trip_geometries=geometries)
+        report = {'dangling tripset ids': {}, 'orphan geometries': [(7, 1, 2)], 'unlisted trip ids': [],
+                  'stale trip ids': [], 'missing geometries': []}
+        integrity_verifier.repair(db, report)
+        self.assertEqual(geometries.deletes, [])
+        integrity_verifier.repair(db, report, delete_orphans=True)
+        self.assertEqual(geometries.deletes, [{'_id': {'$in': [7]}}])
+
+    def testGeocodingRepair(self):
+        class FakeClient:
+            def directions(self, start, end, mode):
+                # Station 9 is on Governor's Island.
+                if 9 in (start[0], end[0]):
+                    raise ValueError("No route")
+                return [{'legs': [{'steps': [{'polyline': {'points': '_p~iF~ps|U_ulLnnqC'}}]}]}]
+
+        def pair(start, end):
+            return {'_id': {'start': start, 'end': end}, 'trips': 1, 'start latitude': start,
+                    'start longitude': 0, 'end latitude': end, 'end longitude': 0}
+        geometries = FakeCollection()
+        db = fake_datastore(trip_geometries=geometries)
+        report = {'dangling tripset ids': {}, 'orphan geometries': [], 'unlisted trip ids': [], 'stale trip ids': [],
+                  'missing geometries': [pair(1, 2), pair(2, 1), pair(1, 9), pair(3, 4), pair(5, 6)]}
+        repaired, failed, pending = integrity_verifier.repair(db, report, client=FakeClient(), limit=3, batch_size=1)
+        # Both orientations of (1, 2) take one query, the failure is reported, and (5, 6) is left for the next run.
+        self.assertEqual(repaired['missing geometries'], 2)
+        self.assertEqual(failed, [(1, 9)])
+        self.assertEqual(pending, 1)
+        self.assertEqual([[(geom['start station id'], geom['end station id']) for geom in batch]
+                          for batch in geometries.inserts], [[(1, 2)], [(3, 4)]])
+
+
+class GeometryAttachmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = fake_datastore(trip_geometries=FakeCollection([
+            {'_id': 0, 'start station id': 1, 'end station id': 2, 'coordinates': [[0, 0], [1, 1]]}
+        ]))
+
+    def testOrderKept(self):
+        trips = [make_trip(0, start=1, end=2, _id=0), make_trip(1, usertype='Rebalancing', start=2, end=1, _id=1),
+                 make_trip(2, usertype='Customer', start=2, end=1, _id=2)]
+        trips = self.db.attach_geometries(trips)
+        self.assertEqual([trip['properties']['tripid'] for trip in trips], [0, 1, 2])
+        self.assertEqual(trips[0]['geometry']['coordinates'], [[0, 0], [1, 1]])
+        self.assertEqual(trips[2]['geometry']['coordinates'], [[1, 1], [0, 0]])
+        self.assertTrue(all('_id' not in trip for trip in trips))
+
+
+class WindowQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = fake_datastore()
+        self.db.max_trip_duration = 3600
+
+    def testLowerBound(self):
+        query = self.db._window_query(np.int64(10000), np.int64(20000))
+        self.assertEqual(query['properties.startepoch'], {'$lt': 20000, '$gte': 10000 - 3600})
+        self.assertTrue(type(query['properties.stopepoch']['$gt']) is int)
+
+    def testUnknownDuration(self):
+        self.db.max_trip_duration = None
+        query = self.db._window_query("6/22/2016 08:00:00", "6/22/2016 09:00:00")
+        self.assertEqual(list(query['properties.startepoch']), ['$lt'])
+
+    def testStoredDuration(self):
+        # Without an override, every query reads the longest trip duration recorded so far.
+        durations = FakeCollection([{'name': 'max-trip-duration', 'seconds': 600}])
+        db = fake_datastore(citibike_trip_ids=durations)
+        self.assertEqual(db._window_query(10000, 20000)['properties.startepoch']['$gte'], 10000 - 600)
+        durations.documents[0]['seconds'] = 7200
+        self.assertEqual(db._window_query(10000, 20000)['properties.startepoch']['$gte'], 10000 - 7200)
+
+    def testTimeParsing(self):
+        # Times parsed without pandas match those parsed by `to_epoch`.
+        for time in ["6/22/2016 8:02:58", "6/22/2016 08:00", "2016-06-22 08:02:58", datetime(2016, 6, 22, 8, 2, 58)]:
+            self.assertEqual(self.db._to_epoch(time), citibike_trips.to_epoch(time))
+
+
+class ViewportQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trips = FakeCollection()
+        self.db = fake_datastore(citibike_trips=self.trips)
+        self.db.station_index = spatial.StationIndex([1, 2, 3], [40.70, 40.71, 40.72], [-74.0, -74.0, -74.0])
+        self.db.geometry_index = spatial.GeometryIndex([(1, 2), (2, 3)], np.array([[40.70, -74.0, 40.71, -74.0],
+                                                                                  [40.71, -74.0, 40.72, -74.0]]))
+
+    def testPairClauses(self):
+        self.db.get_trips_in_bbox((40.69, -74.01, 40.73, -73.99))
+        clauses = self.trips.queries[-1]['$or']
+        self.assertEqual(len(clauses), 2 + 1)
+        self.assertEqual(clauses[-1]['properties.station pair'], {'$in': ['1-2', '2-3']})
+
+    def testStationPairKey(self):
+        self.assertEqual(self.db.station_pair(479.0, 72.0), "72-479")
+        self.assertEqual(self.db.station_pair(72, 479), "72-479")
+
+
 class DataStoreTest(unittest.TestCase):
 
     def setUp(self):
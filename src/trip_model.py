@@ -0,0 +1,448 @@
+"""
+The trip model: single bike and rebalancing trips, and batches of trips. See `citibike_trips`.
+"""
+
+import pandas as pd
+import numpy as np
+import geojson
+from polyline.codec import PolylineCodec
+from datetime import datetime, timedelta
+
+
+##############
+# Trip Times #
+##############
+
+
+def to_epoch(times):
+    """
+    Converts trip start or stop times into integer seconds since the epoch, the numeric form of trip times which time
+    window queries run against.
+
+    Trip times are naive New York local times, and are converted as-is: "6/22/2016 8:02:58" becomes the epoch
+    seconds of 2016-06-22 08:02:58 UTC. Anything querying by epoch needs to do the same.
+
+    Parameters
+    ----------
+    times: str, datetime, or list-like
+        A time, or many times, either as datetimes or as strings in any of the formats found in the dataset.
+
+    Returns
+    -------
+    The time in epoch seconds as an int, or a numpy int64 array of them if many times were passed.
+    """
+    if isinstance(times, (str, datetime)):
+        return int((pd.Timestamp(times) - pd.Timestamp(0)) // pd.Timedelta(seconds=1))
+    times = pd.to_datetime(pd.Series(times))
+    return ((times - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+
+
+class BikeTrip:
+    """
+    Class encoding a single bike trip. Wrapper of a GeoJSON FeatureCollection with lazily loaded geometry.
+    """
+    def __init__(self, raw_trip, client):
+        """
+        Initializes a BikeTrip. Expects a raw trip from the dataset as input---this should be in the form of a
+        pd.Series with a `name` set to be equal to the trip's id in the processed dataset.
+        """
+        props = raw_trip.to_dict()
+        # Because mongodb does not understand numpy data types, in order for this class to be compatible with our
+        # data store we have to cast all of the object stored as numpy types back into base Python types. This has to
+        #  be done manually.
+        for p in ['bikeid', 'birth year', 'gender',
+                  'end station id', 'end station longitude', 'end station latitude',
+                  'start station id', 'start station longitude', 'start station latitude',
+                  'tripduration']:
+            props[p] = float(props[p]) if pd.notnull(props[p]) else 0
+        props['startepoch'] = to_epoch(props['starttime'])
+        props['stopepoch'] = to_epoch(props['stoptime'])
+        # Store the id both in the document store...
+        props['tripid'] = int(raw_trip.name)
+        # And in the Python object, because we'll need easy access to it in order to pass it to the MongoDB id list.
+        self.id = props['tripid']
+        self.data = geojson.Feature(geometry=geojson.LineString(), properties=props)
+        self.client = client
+
+    def __getitem__(self, item):
+        """
+        Makes accessing properties more convenient.
+
+        Implements lazy loading of geometry data.
+        """
+        if item != 'coordinates':
+            return self.data['properties'][item]
+        else:
+            current_geom = self.data['geometry']['coordinates']
+            if len(current_geom) != 0:
+                return current_geom
+            else:
+                path = self.get_bike_trip_path([self['start station latitude'],
+                                                self['start station longitude']],
+                                               [self['end station latitude'],
+                                                self['end station longitude']], self.client)
+                self.data['geometry']['coordinates'] = path
+                return path
+
+    @staticmethod
+    def get_bike_trip_path(start, end, client):
+        """
+        Given a bike trip starting point, a bike trip ending point, and a Google Maps client, returns a list of
+        coordinates corresponding with the path that that bike probably took, as reported by Google Maps.
+
+        Parameters
+        ----------
+        start: list
+            The starting point coordinates, in [latitude, longitude] (or [y, x]) format.
+        end: list
+            The end point coordinates, in [latitude, longitude] (or [y, x]) format.
+        client: googlemaps.Client
+            A `googlemaps.Client` instance, as returned by e.g. `import_google_credentials()`.
+
+        Returns
+        -------
+        The list of [latitude, longitude] coordinates for the given bike trip.
+        """
+        codec = PolylineCodec()
+        req = client.directions(start, end, mode='bicycling')
+        polylines = [step['polyline']['points'] for step in [leg['steps'] for leg in req[0]['legs']][0]]
+        coords = []
+        for polyline in polylines:
+            coords += codec.decode(polyline)
+        return coords
+
+    def to_mongodb(self, datastore):
+        datastore.insert_trip(self)
+
+
+class RebalancingTrip:
+    """
+    Class encoding a single bike trip. Wrapper of a GeoJSON FeatureCollection. Unlike BikeId, not lazily loaded.
+    """
+
+    def __init__(self, delta, client):
+        """
+        This class initializer takes one of two different kinds of inputs in df, plus a valid Google maps client as
+        the client paramater.
+
+        The first kind of input---the one written for the purposes of generating bike-weeks in the original revision
+        of this codebase---is what I call a delta DataFrame. This is DataFrame containing two Series corresponding
+        with two adjacent trips in which the end point of the first trip does not match the start point of the
+        second, implying that a rebalancing trip was made in between the two points.
+
+        The second kind of input---generated later---is a single Series corresponding with a single precalculated
+        rebalancing trip. That is, the expected input in this case is a Series with all of the expected parameters
+        of the core dataset pre-filled. Note that in this case the name of the Series---the Series.name
+        parameter---MUST be a unique id for the trip in question.
+
+        Generating the data I need using the second mode requires significant preprocessing efforts but simplifies
+        the codebase overall because it allows to know, when writing the data to the data store, how many more trips
+        I need to run through the geocoder.
+
+        Pre-filling requires running get_rebalancing_trip_path_time_estimate_tuple() head of time; for more details see
+        notebook 06.
+
+        Either way this class initializer assigns to the object a fully packaged GeoJSON representation. There are a
+        lot of intermediate steps to this process. The GeoJSON representation must be built from scratch. Start time
+        and stop time are computed to be exactly in the middle of the two surrounding trips.
+
+        Compare with the far simpler `bike_tripper()`, which does the same thing for the it-turns-out far simpler case of
+        actual bike trips.
+
+        Parameters
+        ----------
+        delta: pd.DataFrame or pd.Series
+            A pandas DataFrame containing a delta DataFrame (two adjacent bike trips with different start and end
+            points). Alternatively, a single pandas Series containing the preprocessed trip.
+        client: googlemaps.Client
+            A `googlemaps.Client` instance, as returned by e.g. `import_google_credentials()`.
+        """
+        if isinstance(delta, pd.DataFrame):
+            # First initialization type.
+            start_point = delta.iloc[0]
+            end_point = delta.iloc[1]
+            for point in [start_point, end_point]:
+                for time in ['starttime', 'stoptime']:
+                    if isinstance(point[time], str):
+                        point[time] = pd.to_datetime(point[time], infer_datetime_format=True)
+            start_lat, start_long = start_point[["end station latitude", "end station longitude"]]
+            end_lat, end_long = end_point[["start station latitude", "start station longitude"]]
+            coords, time_estimate_mins = self.get_rebalancing_trip_path_time_estimate_tuple([start_lat, start_long],
+                                                                                            [end_lat, end_long], client)
+            midpoint_time = start_point['stoptime'] + ((end_point['starttime'] - start_point['stoptime']) / 2)
+            rebalancing_start_time = midpoint_time - timedelta(minutes=time_estimate_mins / 2)
+            rebalancing_end_time = midpoint_time + timedelta(minutes=time_estimate_mins / 2)
+            if rebalancing_start_time < start_point['stoptime']:
+                rebalancing_start_time = start_point['stoptime']
+            if rebalancing_end_time > end_point['starttime']:
+                rebalancing_end_time = end_point['starttime']
+            # Explicit casts are due to mongodb limitations, see BikeTrip above.
+            attributes = {
+                "tripduration": int(time_estimate_mins * 60),
+                "start station id": int(start_point['end station id']),
+                "end station id": int(end_point['start station id']),
+                "start station name": start_point['end station name'],
+                "end station name": end_point['start station name'],
+                "bikeid": int(start_point["bikeid"]),
+                "usertype": "Rebalancing",
+                "birth year": 0,
+                "gender": 3,
+                "start station latitude": float(start_lat),
+                "start station longitude": float(start_long),
+                "end station latitude": float(end_lat),
+                "end station longitude": float(end_long),
+                "starttime": rebalancing_start_time.strftime("%m/%d/%Y %H:%M:%S").lstrip('0'),
+                "stoptime": rebalancing_end_time.strftime("%m/%d/%Y %H:%M:%S").lstrip('0'),
+                "startepoch": to_epoch(rebalancing_start_time),
+                "stopepoch": to_epoch(rebalancing_end_time),
+                "tripid": delta.index[0]
+            }
+            self.data = geojson.Feature(geometry=geojson.LineString(coords, properties=attributes))
+        elif isinstance(delta, pd.Series):
+            # Second initialization type.
+            coords, _ = self.get_rebalancing_trip_path_time_estimate_tuple([delta["start station latitude"],
+                                                                            delta["start station longitude"]],
+                                                                           [delta["end station latitude"],
+                                                                            delta["end station longitude"]], client)
+            props = delta.to_dict()
+            props['startepoch'] = to_epoch(props['starttime'])
+            props['stopepoch'] = to_epoch(props['stoptime'])
+            # Store the id both in the document store...
+            props['tripid'] = int(delta.name)
+            # And in the Python object, because we'll need easy access to it in order to pass it to the MongoDB id list.
+            self.id = props['tripid']
+            self.data = geojson.Feature(geometry=geojson.LineString(coords), properties=props)
+
+    def __getitem__(self, item):
+        """
+        Makes accessing properties more convenient.
+        """
+        if item != 'coordinates':
+            return self.data['properties'][item]
+        else:
+            return self.data['geometry']['coordinates']
+
+    def to_mongodb(self, datastore):
+        datastore.insert_trip(self)
+
+    @staticmethod
+    def get_rebalancing_trip_path_time_estimate_tuple(start, end, client):
+        """
+        Given a re-balancing trip starting point, a re-balancing trip ending point, and a Google Maps client,
+        returns a list of coordinates corresponding with the path that van probably took, as reported by Google Maps,
+        as well as a time estimate.
+
+        The need to return a tuple containing not just the path (as in the case of very similar `bike_tripper`) stems
+        from the fact that whereas for bikes we have a precise time in transit, we have no such information for
+        rebalancing van trips, meaning that we have to calculate the time taken and timing of such trips ourselves.
+
+        Parameters
+        ----------
+        start: list
+            The starting point coordinates, in [latitude, longitude] (or [y, x]) format.
+        end: list
+            The end point coordinates, in [latitude, longitude] (or [y, x]) format.
+        client: googlemaps.Client
+            A `googlemaps.Client` instance, as returned by e.g. `import_google_credentials()`.
+
+        Returns
+        -------
+        The list of [latitude, longitude] coordinates for the given bike trip.
+        """
+        codec = PolylineCodec()
+        req = client.directions(start, end, mode='driving')
+        # Get the time estimates.
+        # Raw time estimate results are strings of the form "1 min", "5 mins", "1 hour 5 mins", "2 hours 5 mins", etc.
+        time_estimates_raw = [step['duration']['text'] for step in [leg['steps'] for leg in req[0]['legs']][0]]
+        time_estimate_mins = 0
+        for time_estimate_raw in time_estimates_raw:
+            # Can we really get an hour+ estimate biking within the city? Possibly not but I won't risk it.
+            if "min" in time_estimate_raw and "hour" not in time_estimate_raw:
+                time_estimate_mins += int(time_estimate_raw.split(" ")[0])
+            elif "hour" in time_estimate_raw:
+                time_estimate_mins += 60 * int(time_estimate_raw.split(" ")[0])
+                if "min" in time_estimate_raw:
+                    time_estimate_mins += int(time_estimate_raw.split(" ")[2])
+                else:
+                    # Uh-oh.
+                    pass
+        # Get the polylines.
+        polylines = [step['polyline']['points'] for step in [leg['steps'] for leg in req[0]['legs']][0]]
+        coords = []
+        for polyline in polylines:
+            coords += codec.decode(polyline)
+        # Return
+        return coords, time_estimate_mins
+
+    @staticmethod
+    def rebalanced(delta_df):
+        """
+        Parameters
+        ----------
+        delta_df: pd.DataFrame
+            Two bike trips.
+
+        Returns
+        -------
+        Returns True if the bike was rebalanced in between the trips, False otherwise.
+        """
+        ind_1, ind_2 = delta_df.index.values
+        return delta_df.ix[ind_1, 'end station id'] != delta_df.ix[ind_2, 'start station id']
+
+
+class TripBatch:
+    """
+    Class encoding a batch of trips, bike trips and preprocessed rebalancing trips alike. Column-oriented alternative
+    to building one BikeTrip or RebalancingTrip per row: properties are kept as typed numpy arrays taken straight from
+    the columns of the source DataFrame, and geometry is lazily attached per trip.
+    """
+    # The properties which have to be cast to floats before being handed to MongoDB. See BikeTrip.
+    numeric_properties = ['bikeid', 'birth year', 'gender',
+                          'end station id', 'end station longitude', 'end station latitude',
+                          'start station id', 'start station longitude', 'start station latitude',
+                          'tripduration']
+
+    def __init__(self, raw_trips, client):
+        """
+        Initializes a TripBatch.
+
+        Parameters
+        ----------
+        raw_trips: pd.DataFrame
+            Trips from the dataset, in the format of `all_june_22_citibike_trips.csv`. The index MUST be the trip ids.
+            Rebalancing trips are expected in their preprocessed form (see the second mode of RebalancingTrip).
+        client: googlemaps.Client
+            A `googlemaps.Client` instance, as returned by e.g. `import_google_credentials()`.
+        """
+        self.ids = raw_trips.index.values.astype(np.int64)
+        self.properties = dict()
+        for column in raw_trips.columns:
+            values = raw_trips[column]
+            if column in self.numeric_properties:
+                # The vectorized equivalent of the per-property cast in BikeTrip: floats, with nulls stored as 0.
+                values = pd.to_numeric(values, errors='coerce').values.astype(np.float64)
+                values[np.isnan(values)] = 0
+            elif pd.api.types.is_datetime64_any_dtype(values):
+                # Store times in the same string format used by the rest of the dataset.
+                values = values.dt.strftime("%m/%d/%Y %H:%M:%S").str.lstrip('0').to_numpy()
+            else:
+                values = values.to_numpy()
+            self.properties[column] = values
+        self.properties['startepoch'] = to_epoch(raw_trips['starttime'])
+        self.properties['stopepoch'] = to_epoch(raw_trips['stoptime'])
+        self.rebalancing = (raw_trips['usertype'] == 'Rebalancing').to_numpy(dtype=bool)
+        self.geometries = [None] * len(self.ids)
+        self.client = client
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        """
+        Returns a lightweight TripView of the trip at the given position in the batch.
+        """
+        if not -len(self) <= position < len(self):
+            raise IndexError("TripBatch index out of range")
+        return TripView(self, position % len(self))
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield TripView(self, position)
+
+    def get_property(self, item, position):
+        """
+        Returns a single property of the trip at the given position, as a base Python type.
+        """
+        if item == 'tripid':
+            return int(self.ids[position])
+        value = self.properties[item][position]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def station_pairs(self):
+        """
+        Returns an (n, 2) array of the (start station id, end station id) pairs of the trips in the batch.
+        """
+        return np.column_stack([self.properties['start station id'], self.properties['end station id']])
+
+    def coordinates(self, position):
+        """
+        Returns the geometry of the trip at the given position, geocoding it on first access.
+        """
+        if self.geometries[position] is None:
+            start = [float(self.properties['start station latitude'][position]),
+                     float(self.properties['start station longitude'][position])]
+            end = [float(self.properties['end station latitude'][position]),
+                   float(self.properties['end station longitude'][position])]
+            if self.rebalancing[position]:
+                coords, _ = RebalancingTrip.get_rebalancing_trip_path_time_estimate_tuple(start, end, self.client)
+            else:
+                coords = BikeTrip.get_bike_trip_path(start, end, self.client)
+            self.geometries[position] = coords
+        return self.geometries[position]
+
+    def geocode(self, positions):
+        """
+        Attaches geometry to the trips at the given positions. Returns the positions which could not be geocoded.
+        """
+        failed = []
+        for position in positions:
+            try:
+                self.coordinates(position)
+            # Sometimes a trip with impossible coordinates is passed---e.g. it appears that a few CitiBikes take a ferry
+            # ride between Governer's Island and mainland Manhattan. These are reported back to the caller.
+            except Exception:
+                failed.append(position)
+        return failed
+
+    def to_documents(self, positions=None):
+        """
+        Returns the trips at the given positions (all of them, by default) as a list of insert-ready GeoJSON Feature
+        documents.
+
+        Bike trip geometries are stored in the "trip-geometries" store, so their documents are returned with empty
+        coordinates. Rebalancing trip geometry is stored inline, and is geocoded here if it has not been already.
+        """
+        positions = np.arange(len(self)) if positions is None else np.asarray(positions, dtype=np.int64)
+        names = list(self.properties.keys()) + ['tripid']
+        # tolist() casts every numpy value in a column into its base Python counterpart in a single pass.
+        columns = [self.properties[name][positions].tolist() for name in self.properties] + \
+                  [self.ids[positions].tolist()]
+        documents = []
+        for position, row in zip(positions.tolist(), zip(*columns)):
+            coordinates = self.coordinates(position) if self.rebalancing[position] else []
+            documents.append({
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': coordinates},
+                'properties': dict(zip(names, row))
+            })
+        return documents
+
+
+class TripView:
+    """
+    Class encoding a single trip inside of a TripBatch. Supports the same property access as BikeTrip.
+    """
+    __slots__ = ('batch', 'position')
+
+    def __init__(self, batch, position):
+        self.batch = batch
+        self.position = position
+
+    def __getitem__(self, item):
+        """
+        Makes accessing properties more convenient.
+
+        Implements lazy loading of geometry data.
+        """
+        if item != 'coordinates':
+            return self.batch.get_property(item, self.position)
+        else:
+            return self.batch.coordinates(self.position)
+
+    @property
+    def id(self):
+        return int(self.batch.ids[self.position])
+
+    @property
+    def data(self):
+        return self.batch.to_documents([self.position])[0]
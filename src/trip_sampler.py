@@ -3,6 +3,7 @@ Runnable script which generates a JSON dump of a given number of random trips fr
 """
 
 import citibike_trips
+import json
 import pandas as pd
 
 
@@ -20,7 +21,7 @@ def main():
             trips = db.sample(n)
             trips = [trip['geometry']['coordinates'] for trip in trips]
             with open(f, "w") as f:
-                f.write(str(trips))
+                json.dump(trips, f)
     finally:
         db.close()
 